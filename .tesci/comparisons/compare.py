@@ -55,7 +55,6 @@ def compare_results(df1, df2):
 def main():
     df1 = pd.read_excel(Path(args.manual))
     df2 = pd.read_excel(Path(args.automatic))
-    breakpoint()
     precision, recall, f1, jaccard = compare_results(df1, df2)
     # df1 = pd.read_excel(Path("ftn-manual-notmerged-bibliometrija.xlsx"))
     # df2 = pd.read_excel(Path("config-ftn-no_matches_to_compare-matches.xls"))
@@ -0,0 +1,576 @@
+import bisect
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process, utils
+
+# upper bound for a single block of the score matrix (float64 scores)
+BLOCK_SIZE_BYTES = 64 * 1024 * 1024
+# resolver prefixes stripped from identifiers, e.g. https://doi.org/10.1000/1 -> 10.1000/1
+IDENTIFIER_PREFIXES = r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*|https?://openalex\.org/)"
+
+
+def normalize(values: pd.Series) -> list[str | None]:
+    """Normalizes values with rapidfuzz's default processor, missing values (NaN, "nan") become None."""
+    return [
+        None if pd.isna(value) or value == "nan" else utils.default_process(str(value))
+        for value in values
+    ]
+
+
+class NormalizedColumns(object):
+    """
+    Normalized values of the columns of a frame, computed once per column on first use.
+    Scorers can then run with processor=None, both for the candidate search and for comparing
+    the merge columns of candidate pairs. The frame is expected to be preprocessed already.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: dict[str, list[str | None]] | None = None) -> None:
+        self.df = df
+        self._columns = dict(columns) if columns is not None else {}
+
+    def get(self, column: str) -> list[str | None]:
+        if column not in self._columns:
+            self._columns[column] = normalize(self.df[column])
+        return self._columns[column]
+
+    def cached(self) -> dict[str, list[str | None]]:
+        """Columns normalized so far."""
+        return self._columns
+
+    def discard(self, column: str) -> None:
+        """Drops a cached column, e.g. after its values were preprocessed again."""
+        self._columns.pop(column, None)
+
+
+def best_candidates(
+    queries: list[str | None],
+    choices: list[str | None],
+    scorer=fuzz.QRatio,
+    workers: int = -1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the best scoring choice for every query. Both queries and choices are expected to be
+    normalized already (see `normalize`). The score matrix is computed in blocks of queries
+    on all cores, so memory use stays bounded by BLOCK_SIZE_BYTES.
+
+    Returns the positional index and the score of the best choice per query as NumPy arrays.
+    Ties resolve to the first choice, same as `process.extractOne`. Queries without a valid
+    value, or without any valid choice, get index -1 and a NaN score.
+    """
+    best_idx = np.full(len(queries), -1, dtype=np.int64)
+    best_score = np.full(len(queries), np.nan, dtype=np.float64)
+
+    choices_valid = np.array([choice is not None for choice in choices], dtype=bool)
+    if len(queries) == 0 or not choices_valid.any():
+        return best_idx, best_score
+
+    queries_valid = np.array([query is not None for query in queries], dtype=bool)
+    query_positions = np.flatnonzero(queries_valid)
+    valid_queries = [queries[pos] for pos in query_positions]
+    valid_choices = [choice if choice is not None else "" for choice in choices]
+
+    block_rows = max(1, BLOCK_SIZE_BYTES // (8 * len(choices)))
+    for start in range(0, len(valid_queries), block_rows):
+        block = process.cdist(
+            valid_queries[start : start + block_rows],
+            valid_choices,
+            scorer=scorer,
+            dtype=np.float64,
+            workers=workers,
+        )
+        # invalid choices are skipped by extractOne, scores are never below 0
+        block[:, ~choices_valid] = -1
+        idx = block.argmax(axis=1)
+        positions = query_positions[start : start + block_rows]
+        best_idx[positions] = idx
+        best_score[positions] = block[np.arange(len(idx)), idx]
+
+    return best_idx, best_score
+
+
+def best_candidates_both_ways(
+    queries: list[str | None],
+    choices: list[str | None],
+    scorer=fuzz.QRatio,
+    workers: int = -1,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Like `best_candidates`, but also finds the best query for every choice from the same
+    score matrix, e.g. to search a chunk of one source against the other and the other way
+    round at once. Ties resolve to the first query, queries without a valid value are skipped.
+
+    Returns the best choice and score per query, then the best query and score per choice.
+    """
+    best_idx = np.full(len(queries), -1, dtype=np.int64)
+    best_score = np.full(len(queries), np.nan, dtype=np.float64)
+    best_query = np.full(len(choices), -1, dtype=np.int64)
+    best_query_score = np.full(len(choices), -1.0, dtype=np.float64)
+
+    choices_valid = np.array([choice is not None for choice in choices], dtype=bool)
+    query_positions = np.flatnonzero([query is not None for query in queries])
+    if len(query_positions) == 0 or not choices_valid.any():
+        return best_idx, best_score, best_query, np.full(len(choices), np.nan)
+
+    valid_queries = [queries[pos] for pos in query_positions]
+    valid_choices = [choice if choice is not None else "" for choice in choices]
+    block_rows = max(1, BLOCK_SIZE_BYTES // (8 * len(choices)))
+    for start in range(0, len(valid_queries), block_rows):
+        block = process.cdist(
+            valid_queries[start : start + block_rows],
+            valid_choices,
+            scorer=scorer,
+            dtype=np.float64,
+            workers=workers,
+        )
+        block[:, ~choices_valid] = -1
+        positions = query_positions[start : start + block_rows]
+        idx = block.argmax(axis=1)
+        best_idx[positions] = idx
+        best_score[positions] = block[np.arange(len(idx)), idx]
+        # earlier blocks win ties, like argmax within a block
+        rows = block.argmax(axis=0)
+        scores = block[rows, np.arange(len(choices))]
+        better = scores > best_query_score
+        best_query[better] = positions[rows[better]]
+        best_query_score[better] = scores[better]
+
+    best_query_score[~choices_valid] = np.nan
+    best_query[~choices_valid] = -1
+    return best_idx, best_score, best_query, best_query_score
+
+
+def block_key(value, prefix: int | None = None) -> str | None:
+    """Normalizes a single blocking value, missing values (NaN, "nan") become None."""
+    if pd.isna(value) or value == "nan":
+        return None
+    key = utils.default_process(str(value))
+    return key[:prefix] if prefix is not None else key
+
+
+class BlockIndex(object):
+    """
+    Hash index over the block keys of the reference side of a merge. Each key is a tuple with
+    one value per `block_on` entry. A query only needs to be scored against reference rows
+    that share every key value, or that lie within `window` neighbouring values in sorted
+    order (sorted neighbourhood). Missing values on either side never exclude a row.
+    """
+
+    def __init__(self, keys: list[tuple], windows: list[int]) -> None:
+        self.size = len(keys)
+        self.windows = windows
+        self._postings = []
+        self._missing = []
+        self._sorted_values = []
+        for entry in range(len(windows)):
+            postings = {}
+            missing = []
+            for pos, key in enumerate(keys):
+                if key[entry] is None:
+                    missing.append(pos)
+                else:
+                    postings.setdefault(key[entry], []).append(pos)
+            self._postings.append({value: np.array(p) for value, p in postings.items()})
+            self._missing.append(np.array(missing, dtype=np.int64))
+            self._sorted_values.append(sorted(postings.keys()))
+
+    def lookup(self, key: tuple) -> np.ndarray:
+        """Returns sorted positions of the reference rows that are in the same block as key."""
+        positions = None
+        for entry, value in enumerate(key):
+            if value is None:
+                continue
+            entry_positions = [self._missing[entry]]
+            for neighbour in self._neighbours(entry, value):
+                entry_positions.append(self._postings[entry][neighbour])
+            entry_positions = np.concatenate(entry_positions)
+            if positions is None:
+                positions = entry_positions
+            else:
+                positions = np.intersect1d(positions, entry_positions, assume_unique=True)
+        if positions is None:
+            return np.arange(self.size)
+        return np.sort(positions)
+
+    def _neighbours(self, entry: int, value: str) -> list[str]:
+        values = self._sorted_values[entry]
+        window = self.windows[entry]
+        if window == 0:
+            return [value] if value in self._postings[entry] else []
+        pos = bisect.bisect_left(values, value)
+        exact = pos < len(values) and values[pos] == value
+        return values[max(0, pos - window) : pos + window + (1 if exact else 0)]
+
+
+def blocked_best_candidates(
+    queries: list[str | None],
+    choices: list[str | None],
+    query_keys: list[tuple],
+    index: BlockIndex,
+    scorer=fuzz.QRatio,
+    workers: int = -1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Same as `best_candidates`, but every query is only scored against the choices in its
+    block. Queries that share a block key are scored together in one batch.
+    """
+    best_idx = np.full(len(queries), -1, dtype=np.int64)
+    best_score = np.full(len(queries), np.nan, dtype=np.float64)
+
+    groups = {}
+    for pos, key in enumerate(query_keys):
+        groups.setdefault(key, []).append(pos)
+
+    for key, query_positions in groups.items():
+        choice_positions = index.lookup(key)
+        if len(choice_positions) == 0:
+            continue
+        idx, score = best_candidates(
+            [queries[pos] for pos in query_positions],
+            [choices[pos] for pos in choice_positions],
+            scorer=scorer,
+            workers=workers,
+        )
+        found = idx >= 0
+        query_positions = np.array(query_positions)
+        best_idx[query_positions[found]] = choice_positions[idx[found]]
+        best_score[query_positions[found]] = score[found]
+
+    return best_idx, best_score
+
+
+def normalize_identifiers(values: pd.Series) -> pd.Series:
+    """Lowercases identifiers and strips DOI/OpenAlex resolver prefixes, missing values become NA."""
+    values = values.astype("string").str.strip().str.lower()
+    values = values.str.replace(IDENTIFIER_PREFIXES, "", regex=True)
+    return values.mask(values.isin(["", "nan", "none"]))
+
+
+def exact_key_pairs(left: pd.Series, right: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hash-joins two identifier columns after `normalize_identifiers`. Every row takes part in at
+    most one pair, duplicated identifiers only pair their first occurrence.
+
+    Returns the positional indexes of the left and right rows of every pair, in right order.
+    """
+    left_keys = pd.DataFrame(
+        {"key": normalize_identifiers(left).to_numpy(), "left": np.arange(len(left))}
+    )
+    right_keys = pd.DataFrame(
+        {"key": normalize_identifiers(right).to_numpy(), "right": np.arange(len(right))}
+    )
+    left_keys = left_keys.dropna(subset="key").drop_duplicates(subset="key")
+    right_keys = right_keys.dropna(subset="key").drop_duplicates(subset="key")
+    pairs = right_keys.merge(left_keys, on="key", how="inner", sort=False)
+    return pairs["left"].to_numpy(), pairs["right"].to_numpy()
+
+
+def top_candidates(
+    queries: list[str | None],
+    choices: list[str | None],
+    k: int = 5,
+    scorer=fuzz.QRatio,
+    workers: int = -1,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Keeps the k best choices of every query and the k best queries of every choice, from a
+    single pass over the score matrix. The matrix is computed in blocks like `best_candidates`.
+
+    Returns the query positions, choice positions and scores of the kept pairs (sparse, one
+    entry per pair, sorted by query and choice position).
+    """
+    rows, cols, scores = [], [], []
+
+    choices_valid = np.array([choice is not None for choice in choices], dtype=bool)
+    query_positions = np.flatnonzero([query is not None for query in queries])
+    if len(query_positions) == 0 or not choices_valid.any():
+        return _unique_pairs(rows, cols, scores, len(choices))
+    valid_queries = [queries[pos] for pos in query_positions]
+    valid_choices = [choice if choice is not None else "" for choice in choices]
+
+    # running k best queries per choice, merged block by block
+    col_scores = np.full((0, len(choices)), -1.0)
+    col_rows = np.full((0, len(choices)), -1, dtype=np.int64)
+
+    block_rows = max(1, BLOCK_SIZE_BYTES // (8 * len(choices)))
+    for start in range(0, len(valid_queries), block_rows):
+        block = process.cdist(
+            valid_queries[start : start + block_rows],
+            valid_choices,
+            scorer=scorer,
+            dtype=np.float64,
+            workers=workers,
+        )
+        block[:, ~choices_valid] = -1
+        positions = query_positions[start : start + block_rows]
+
+        row_k = min(k, block.shape[1])
+        top = np.argpartition(-block, row_k - 1, axis=1)[:, :row_k]
+        rows.append(np.repeat(positions, row_k))
+        cols.append(top.ravel())
+        scores.append(np.take_along_axis(block, top, axis=1).ravel())
+
+        merged_scores = np.vstack([col_scores, block])
+        merged_rows = np.vstack([col_rows, np.broadcast_to(positions[:, None], block.shape)])
+        col_k = min(k, merged_scores.shape[0])
+        top = np.argpartition(-merged_scores, col_k - 1, axis=0)[:col_k]
+        col_scores = np.take_along_axis(merged_scores, top, axis=0)
+        col_rows = np.take_along_axis(merged_rows, top, axis=0)
+
+    rows.append(col_rows.ravel())
+    cols.append(np.tile(np.arange(len(choices)), col_rows.shape[0]))
+    scores.append(col_scores.ravel())
+    return _unique_pairs(rows, cols, scores, len(choices))
+
+
+def blocked_top_candidates(
+    queries: list[str | None],
+    choices: list[str | None],
+    query_keys: list[tuple],
+    index: BlockIndex,
+    k: int = 5,
+    scorer=fuzz.QRatio,
+    workers: int = -1,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Same as `top_candidates`, but every query is only scored against the choices in its block."""
+    rows, cols, scores = [], [], []
+
+    groups = {}
+    for pos, key in enumerate(query_keys):
+        groups.setdefault(key, []).append(pos)
+
+    for key, query_positions in groups.items():
+        choice_positions = index.lookup(key)
+        if len(choice_positions) == 0:
+            continue
+        group_rows, group_cols, group_scores = top_candidates(
+            [queries[pos] for pos in query_positions],
+            [choices[pos] for pos in choice_positions],
+            k=k,
+            scorer=scorer,
+            workers=workers,
+        )
+        rows.append(np.array(query_positions)[group_rows])
+        cols.append(choice_positions[group_cols])
+        scores.append(group_scores)
+
+    return _unique_pairs(rows, cols, scores, len(choices))
+
+
+def _unique_pairs(rows, cols, scores, n_choices) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if not rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+    rows = np.concatenate(rows).astype(np.int64)
+    cols = np.concatenate(cols).astype(np.int64)
+    scores = np.concatenate(scores)
+    # drop padding and pairs with an invalid choice
+    valid = (rows >= 0) & (scores >= 0)
+    rows, cols, scores = rows[valid], cols[valid], scores[valid]
+    _, unique = np.unique(rows * n_choices + cols, return_index=True)
+    return rows[unique], cols[unique], scores[unique]
+
+
+class NgramIndex(object):
+    """
+    Inverted index of character n-grams over normalized reference values. The candidates of a
+    query are the choices that share the most n-grams with it, weighted by inverse document
+    frequency and normalized by the number of n-grams of the choice, so long choices do not
+    crowd out close ones. N-grams found in more than max_df of the choices are not indexed, they would
+    barely narrow down the candidates but make up most of the postings.
+    """
+
+    def __init__(self, choices: list[str | None], n: int = 3, max_df: float = 0.1) -> None:
+        self.n = n
+        self.size = len(choices)
+        vocabulary = {}
+        gram_ids = []
+        doc_ids = []
+        for pos, choice in enumerate(choices):
+            if choice is None:
+                continue
+            for gram in self._grams(choice):
+                gram_ids.append(vocabulary.setdefault(gram, len(vocabulary)))
+                doc_ids.append(pos)
+        gram_ids = np.array(gram_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+
+        # postings in CSR layout: choices of gram i are postings[indptr[i] : indptr[i + 1]]
+        order = np.argsort(gram_ids, kind="stable")
+        self.postings = doc_ids[order]
+        doc_freq = np.bincount(gram_ids, minlength=len(vocabulary))
+        self.indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=self.indptr[1:])
+        n_docs = max(1, sum(choice is not None for choice in choices))
+        self.idf = np.log(n_docs / np.maximum(doc_freq, 1))
+        self.norm = np.sqrt(np.maximum(np.bincount(doc_ids, minlength=self.size), 1))
+        self.vocabulary = {
+            gram: i for gram, i in vocabulary.items() if doc_freq[i] <= max(1, max_df * n_docs)
+        }
+
+    def _grams(self, value: str) -> set[str]:
+        padded = f" {value} "
+        return {padded[i : i + self.n] for i in range(len(padded) - self.n + 1)}
+
+    def save(self, directory: Path) -> None:
+        """Writes the index to directory, see `load`."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ("postings", "indptr", "idf", "norm"):
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        with open(directory / "vocabulary.json", "w") as vocabulary_file:
+            json.dump({"n": self.n, "size": self.size, "grams": self.vocabulary}, vocabulary_file)
+
+    @classmethod
+    def load(cls, directory: Path) -> "NgramIndex":
+        """Opens an index written by `save`, its arrays are memory-mapped."""
+        directory = Path(directory)
+        index = cls.__new__(cls)
+        with open(directory / "vocabulary.json", "r") as vocabulary_file:
+            content = json.load(vocabulary_file)
+        index.n, index.size, index.vocabulary = content["n"], content["size"], content["grams"]
+        for name in ("postings", "indptr", "idf", "norm"):
+            setattr(index, name, np.load(directory / f"{name}.npy", mmap_mode="r"))
+        return index
+
+    def shortlist(
+        self,
+        query: str,
+        size: int,
+        allowed: np.ndarray | None = None,
+        valid: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """
+        Sorted positions of at most size choices sharing the most n-grams with query, limited
+        to allowed positions and to the choices of the valid mask if given. Queries without
+        indexed n-grams get every choice.
+        """
+        ids = [self.vocabulary[gram] for gram in self._grams(query) if gram in self.vocabulary]
+        if not ids:
+            positions = allowed if allowed is not None else np.arange(self.size)
+            return positions[valid[positions]] if valid is not None else positions
+        postings = np.concatenate([self.postings[self.indptr[i] : self.indptr[i + 1]] for i in ids])
+        weights = np.repeat(self.idf[ids], self.indptr[np.array(ids) + 1] - self.indptr[ids])
+        positions, inverse = np.unique(postings, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights) / self.norm[positions]
+        if allowed is not None:
+            keep = np.isin(positions, allowed)
+            positions, scores = positions[keep], scores[keep]
+        if valid is not None:
+            # choices removed after the index was built, e.g. rows matched by exact keys
+            keep = valid[positions]
+            positions, scores = positions[keep], scores[keep]
+        if len(positions) > size:
+            # equally scored choices are taken in position order, like the full search
+            top = np.lexsort((positions, -scores))[:size]
+            positions = np.sort(positions[top])
+        return positions
+
+
+def indexed_candidates(
+    queries: list[str | None],
+    choices: list[str | None],
+    ngram_index: NgramIndex,
+    shortlist: int = 50,
+    query_keys: list[tuple] | None = None,
+    block_index: BlockIndex | None = None,
+    scorer=fuzz.QRatio,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scores every query against its n-gram shortlist (within its block, if blocking is used)
+    instead of against all choices.
+
+    Returns the query positions, choice positions and scores of all scored pairs, sorted by
+    query and choice position.
+    """
+    valid = np.array([choice is not None for choice in choices], dtype=bool)
+    rows, cols, scores = [], [], []
+    for pos, query in enumerate(queries):
+        if query is None:
+            continue
+        allowed = block_index.lookup(query_keys[pos]) if block_index is not None else None
+        positions = ngram_index.shortlist(query, shortlist, allowed, valid)
+        if len(positions) == 0:
+            continue
+        rows.append(np.full(len(positions), pos, dtype=np.int64))
+        cols.append(positions)
+        scores.append(
+            process.cdist(
+                [query], [choices[p] for p in positions], scorer=scorer, dtype=np.float64
+            )[0]
+        )
+    return _unique_pairs(rows, cols, scores, len(choices))
+
+
+def best_of_pairs(
+    n_queries: int, rows: np.ndarray, cols: np.ndarray, scores: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Reduces scored pairs sorted by query and choice position to the best choice per query."""
+    best_idx = np.full(n_queries, -1, dtype=np.int64)
+    best_score = np.full(n_queries, np.nan, dtype=np.float64)
+    # highest score first, ties resolve to the first choice
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    first = _group_starts(rows)
+    best_idx[rows[first]] = cols[first]
+    best_score[rows[first]] = scores[first]
+    return best_idx, best_score
+
+
+def top_of_pairs(
+    rows: np.ndarray, cols: np.ndarray, scores: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Reduces scored pairs to the k best choices per query."""
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = _group_starts(rows)
+    rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = rank < k
+    order = np.lexsort((cols[keep], rows[keep]))
+    return rows[keep][order], cols[keep][order], scores[keep][order]
+
+
+def _group_starts(rows: np.ndarray) -> np.ndarray:
+    """Indexes where a new query starts in pairs sorted by query position."""
+    if len(rows) == 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of records. With the source of every record, a set holds at most one
+    record of every source, and keeps the sources of its records as a bit mask.
+    """
+
+    def __init__(self, n: int, record_sources: np.ndarray | None = None) -> None:
+        self.parent = list(range(n))
+        self.sources = (
+            [1 << int(source) for source in record_sources] if record_sources is not None else None
+        )
+
+    def find(self, record: int) -> int:
+        root = record
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # path compression
+        while self.parent[record] != root:
+            self.parent[record], record = root, self.parent[record]
+        return root
+
+    def union(self, record1: int, record2: int) -> bool:
+        """Joins the sets of two records, unless they already share a source. The smaller root stays."""
+        root1, root2 = self.find(record1), self.find(record2)
+        if root1 == root2:
+            return False
+        if self.sources is not None and self.sources[root1] & self.sources[root2]:
+            return False
+        if root2 < root1:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        if self.sources is not None:
+            self.sources[root1] |= self.sources[root2]
+        return True
+
+    def roots(self) -> np.ndarray:
+        return np.array([self.find(record) for record in range(len(self.parent))], dtype=np.int64)
@@ -0,0 +1,165 @@
+import itertools
+import logging
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tesci import candidates, similarity
+from tesci.scripts.context import Config, DataSource
+from tesci.similarity import MergeSide, MergeState
+
+# candidates kept per record and direction for every pair of sources
+DEFAULT_TOP_K = 3
+
+
+def _get_merge_config(config: Config, source: int) -> dict:
+    """Merge config of the stage of source (counted from 0), the only one without stages."""
+    if "stage_1" not in config.content["join"]["similarity_config"]["merge"]:
+        return similarity._get_merge_config(config, None)
+    return similarity._get_merge_config(config, source)
+
+
+def _source_columns(config: Config, n_sources: int) -> list[list[dict]]:
+    """
+    Merge columns of every source, named as in the first source. The stage_i columns map the
+    from_ columns of source i to the into_ columns of the first source, stage_1 also gives
+    the columns of the first source.
+    """
+    if similarity._get_multi_stage_nums(config) < n_sources - 1:
+        raise ValueError(
+            f"Clustering {n_sources} sources needs the columns of stage_1 to stage_{n_sources - 1}."
+        )
+    stage_columns = [
+        _get_merge_config(config, source)["columns"] for source in range(1, n_sources)
+    ]
+    source_columns = [
+        [dict(column, from_=column["into_"]) for column in stage_columns[0]]
+    ] + stage_columns
+    for columns in source_columns:
+        for column in columns:
+            column["from_"] = column["from_"].lower()
+            column["into_"] = column["into_"].lower()
+    return source_columns
+
+
+def merge(sources: list[Path], dest: Path | None, workers: int = 1) -> None:
+    """
+    Merges all sources in one pass. The reference columns of every pair of sources are scored
+    once, keeping the best candidates of every record in either direction, and candidate
+    pairs are verified with the merge columns of the later source's stage. Rows with equal
+    `exact_keys` identifiers are paired as well. Records are then grouped into entities with
+    union-find, taking the best pairs (exact, then suggested, highest score first) and never
+    putting two records of one source into an entity.
+
+    Saves every record with its entity to config-clusters and one record per entity, with
+    the values of the earliest source taking precedence, to config-final.
+    """
+    config = Config()
+    if "similarity_config" not in config.content.get("join", {}).keys():
+        logging.info(
+            "No similarity_config to apply to the dataset. Are you using a config file that has similarity_config?"
+        )
+        return
+    if len(sources) < 2:
+        raise ValueError("Clustering needs at least two sources.")
+    source_columns = _source_columns(config, len(sources))
+
+    sides = []
+    for columns, src in zip(source_columns, sources):
+        df = similarity._load_source(src)
+        df.rename(columns=str.lower, inplace=True)
+        similarity._preprocess_sources(columns, None, df, workers)
+        df.rename(columns={column["from_"]: column["into_"] for column in columns}, inplace=True)
+        df.reset_index(drop=True, inplace=True)
+        reference_column = similarity._get_reference_column(columns)
+        sides.append(MergeSide.create(df, reference_column["into_"]))
+
+    offsets = np.cumsum([0] + [len(side.df) for side in sides])
+    record_sources = np.repeat(np.arange(len(sides)), [len(side.df) for side in sides])
+    with tempfile.TemporaryDirectory(prefix="tesci-") as shared_dir:
+        if workers > 1:
+            # pool workers memory-map the normalized columns, pairs of sources are verified with
+            # the columns of the later source's stage
+            names = list(
+                dict.fromkeys(column["into_"] for columns in source_columns for column in columns)
+            )
+            for k, side in enumerate(sides):
+                side.share(
+                    Path(shared_dir) / f"source_{k + 1}",
+                    [name for name in names if name in side.df.columns],
+                )
+        edges = []
+        for i, j in itertools.combinations(range(len(sides)), 2):
+            # into_ names on both sides, thresholds of the later source's stage
+            columns = [dict(column, from_=column["into_"]) for column in source_columns[j]]
+            merge_config = _get_merge_config(config, j)
+            exact_keys = [
+                dict(column, from_=column["into_"])
+                for column in similarity._get_exact_keys(merge_config, source_columns[j])
+            ]
+            key_pairs1, key_pairs2 = similarity._match_exact_keys(sides[i].df, sides[j].df, exact_keys)
+            edges.append(
+                pd.DataFrame(
+                    {
+                        "record1": offsets[i] + key_pairs1,
+                        "record2": offsets[j] + key_pairs2,
+                        "score": 100.0,
+                        "state": MergeState.EXACT.value,
+                    }
+                )
+            )
+            rows, cols, scores = candidates.top_candidates(
+                sides[j].reference,
+                sides[i].reference,
+                k=merge_config.get("top_k", DEFAULT_TOP_K),
+                workers=similarity._search_workers(workers),
+            )
+            valid = scores >= 0
+            rows, cols, scores = rows[valid], cols[valid], scores[valid]
+            states = similarity._classify_pairs(columns, sides[i], sides[j], cols, rows, workers)
+            print(f"[source {i + 1}, source {j + 1}] Scored {len(rows)} candidate pairs")
+            edges.append(
+                pd.DataFrame(
+                    {
+                        "record1": offsets[i] + cols,
+                        "record2": offsets[j] + rows,
+                        "score": scores,
+                        "state": states,
+                    }
+                )
+            )
+
+    edges = pd.concat(edges, ignore_index=True)
+    edges = edges[edges["state"] <= MergeState.SUGGESTED.value].sort_values(
+        ["state", "score", "record1", "record2"], ascending=[True, False, True, True]
+    )
+    clusters = candidates.UnionFind(len(record_sources), record_sources)
+    for record1, record2 in zip(edges["record1"].tolist(), edges["record2"].tolist()):
+        clusters.union(record1, record2)
+
+    roots = clusters.roots()
+    # entities are numbered in the order of their first record
+    _, entity = np.unique(roots, return_inverse=True)
+    records = pd.concat([side.df for side in sides], ignore_index=True)
+    records.insert(0, "source", record_sources + 1)
+    records.insert(0, "entity", entity)
+    records = records.sort_values(["entity", "source"], kind="stable")
+    final = records.groupby("entity", sort=True).first().drop(columns="source")
+
+    sizes = np.bincount(np.bincount(entity))
+    print(
+        {
+            "records": len(records),
+            "entities": int(entity.max()) + 1 if len(entity) else 0,
+            "entities by number of records": {
+                size: int(count) for size, count in enumerate(sizes) if size > 0 and count > 0
+            },
+        }
+    )
+    path_override = Path(dest) if dest is not None else None
+    DataSource.save_to_file(
+        records, Config(), name_override="config-clusters.xls", path_override=path_override
+    )
+    DataSource.save_to_file(final.reset_index(drop=True), Config(), name_override="config-final.xls")
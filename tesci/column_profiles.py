@@ -0,0 +1,135 @@
+import attrs
+import numpy as np
+import pandas as pd
+
+from tesci import candidates
+from tesci.types import FuzzyColumnCandidates, MatchesPerColumn
+
+# MinHash permutations per column sketch
+NUM_PERMUTATIONS = 64
+# leading rows of a column the sketch is computed from
+SKETCH_ROWS = 2000
+# upper bounds of the value length histogram bins, the last bin is open
+LENGTH_BINS = np.array([0, 4, 8, 16, 32, 64, 128, 256, np.inf])
+# columns of the other source verified with the fuzzy scorer, per column
+TOP_PAIRS = 3
+# sample values per column used for the verification
+VERIFY_SAMPLES = 19
+
+_rng = np.random.default_rng(0)
+# universal hashing (a * x + b) mod 2^64, one (a, b) per permutation, a odd
+_PERMUTATION_A = _rng.integers(1, 2**63, NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_PERMUTATION_B = _rng.integers(0, 2**63, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+@attrs.define
+class ColumnProfile:
+    """Compact sketch of a column, cheap to compare with the sketches of other columns."""
+
+    name: str
+    kind: str
+    distinct: float
+    lengths: np.ndarray
+    signature: np.ndarray
+    sample: list[str]
+
+    @property
+    def empty(self) -> bool:
+        return len(self.sample) == 0
+
+
+def _column_kind(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(series):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    return "text"
+
+
+def profile_column(name: str, series: pd.Series) -> ColumnProfile:
+    """
+    Profiles the first SKETCH_ROWS values of a column: dtype kind, share of distinct values,
+    histogram of value lengths and MinHash signature of the normalized tokens.
+    """
+    values = [value for value in candidates.normalize(series.iloc[:SKETCH_ROWS]) if value]
+    unique = list(dict.fromkeys(values))
+    tokens = {token for value in unique for token in value.split()}
+
+    signature = np.full(NUM_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if tokens:
+        hashes = pd.util.hash_array(np.array(list(tokens), dtype=object))
+        # uint64 arithmetic wraps around, which is the mod 2^64 of the hash family
+        permuted = _PERMUTATION_A[:, None] * hashes[None, :] + _PERMUTATION_B[:, None]
+        signature = permuted.min(axis=1)
+
+    lengths, _ = np.histogram([len(value) for value in values], bins=LENGTH_BINS)
+    return ColumnProfile(
+        name=name,
+        kind=_column_kind(series),
+        distinct=len(unique) / len(values) if values else 0.0,
+        lengths=lengths / max(1, len(values)),
+        signature=signature,
+        sample=unique[:VERIFY_SAMPLES],
+    )
+
+
+def sketch_similarity(profile1: ColumnProfile, profile2: ColumnProfile) -> float:
+    """
+    Similarity of two column sketches between 0 and 1, mostly the estimated Jaccard similarity
+    of their tokens. Columns without any shared token get 0.
+    """
+    if profile1.empty or profile2.empty:
+        return 0.0
+    jaccard = float(np.mean(profile1.signature == profile2.signature))
+    if jaccard == 0:
+        return 0.0
+    lengths = 1 - 0.5 * float(np.abs(profile1.lengths - profile2.lengths).sum())
+    distinct = 1 - abs(profile1.distinct - profile2.distinct)
+    kind = 1.0 if profile1.kind == profile2.kind else 0.5
+    return kind * (0.6 * jaccard + 0.2 * lengths + 0.2 * distinct)
+
+
+def match_columns(df1: pd.DataFrame, df2: pd.DataFrame, score_cutoff: float) -> MatchesPerColumn:
+    """
+    Finds the columns of df2 holding the same data as the columns of df1. Column pairs are
+    ranked by their sketches, only the TOP_PAIRS best pairs per df1 column are verified by
+    searching sample values of the df1 column in the df2 column with QRatio.
+
+    The candidates of a df1 column are the sample values scoring at least score_cutoff,
+    grouped by df2 column, the column with the most of them first.
+    """
+    profiles2 = [profile_column(col2, df2[col2]) for col2 in df2.columns]
+    normalized2 = candidates.NormalizedColumns(df2)
+
+    matches = MatchesPerColumn()
+    for col1 in df1.columns:
+        print("[df1] Processing column: ", col1)
+        profile1 = profile_column(col1, df1[col1])
+        ranked = sorted(
+            ((sketch_similarity(profile1, profile2), profile2.name) for profile2 in profiles2),
+            key=lambda pair: pair[0],
+            reverse=True,
+        )
+        verified = []
+        for similarity, col2 in ranked[:TOP_PAIRS]:
+            if similarity == 0:
+                break
+            choices = normalized2.get(col2)
+            best_idx, best_score = candidates.best_candidates(profile1.sample, choices)
+            hits = [
+                FuzzyColumnCandidates(
+                    column=col2,
+                    reference_data=query,
+                    fuzzy_matches=(choices[idx], score, idx),
+                )
+                for query, idx, score in zip(profile1.sample, best_idx, best_score)
+                if idx >= 0 and score >= score_cutoff
+            ]
+            if hits:
+                verified.append((len(hits), similarity, hits))
+        verified.sort(key=lambda entry: entry[:2], reverse=True)
+        for _, _, hits in verified:
+            matches.column_candidates.setdefault(col1, []).extend(hits)
+    return matches
@@ -0,0 +1,68 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+MANIFEST_NAME = "columns.json"
+
+
+def write_columns(directory: Path, columns: dict[str, list[str | None]]) -> None:
+    """
+    Stores normalized string columns in directory so they can be memory-mapped by
+    `MappedColumns`. Every column is a UTF-8 blob with an offsets array and a missing mask.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = {}
+    for i, (name, values) in enumerate(columns.items()):
+        encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        missing = np.array([value is None for value in values], dtype=bool)
+        np.save(directory / f"{i}.offsets.npy", offsets)
+        np.save(directory / f"{i}.missing.npy", missing)
+        with open(directory / f"{i}.blob", "wb") as blob_file:
+            blob_file.write(b"".join(encoded))
+        manifest[name] = i
+    with open(directory / MANIFEST_NAME, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+class MappedColumn(object):
+    """Read-only, memory-mapped string column. Values are decoded on access."""
+
+    def __init__(self, directory: Path, i: int) -> None:
+        self.offsets = np.load(directory / f"{i}.offsets.npy", mmap_mode="r")
+        self.missing = np.load(directory / f"{i}.missing.npy", mmap_mode="r")
+        blob_path = directory / f"{i}.blob"
+        # np.memmap cannot map empty files
+        if blob_path.stat().st_size > 0:
+            self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self.blob = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.missing)
+
+    def __getitem__(self, pos: int) -> str | None:
+        if self.missing[pos]:
+            return None
+        return self.blob[self.offsets[pos] : self.offsets[pos + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[pos] for pos in range(len(self)))
+
+
+class MappedColumns(object):
+    """Columns written by `write_columns`, with the same `get` interface as NormalizedColumns."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+        with open(self.directory / MANIFEST_NAME, "r") as manifest_file:
+            self._manifest = json.load(manifest_file)
+        self._columns = {}
+
+    def get(self, column: str) -> MappedColumn:
+        if column not in self._columns:
+            self._columns[column] = MappedColumn(self.directory, self._manifest[column])
+        return self._columns[column]
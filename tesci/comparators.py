@@ -0,0 +1,258 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import utils
+
+from tesci import candidates
+
+COMPARATOR_TYPES = ["text", "int", "exact", "doi", "set_jaccard", "authors"]
+# author list separators: "; " (Scopus, WoS) and "|" (joined OpenAlex lists)
+AUTHOR_SEPARATORS = r"[;|]"
+# trailing initials of "Surname J." / "Surname J.-P." / "Surname JP" names
+INITIALS = re.compile(r"^(?:[A-Z]\.?-?)+$")
+
+
+class Comparator(object):
+    """
+    Column-wise comparison of a typed merge column. `encode` converts a whole column once,
+    `scores` compares the encoded values of many pairs at once. Scores range from 0 to 100
+    and are NaN where either value is missing.
+    """
+
+    name = ""
+
+    def encode(self, series: pd.Series):
+        raise NotImplementedError
+
+    def scores(self, encoded1, pos1: np.ndarray, encoded2, pos2: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        return self.name
+
+
+class IntComparator(Comparator):
+    """
+    Numbers, e.g. years. Equal numbers score 100, with a tolerance every unit of difference
+    costs 100 / (tolerance + 1), so a year_tolerance of 1 scores a year apart 50.
+    """
+
+    name = "int"
+
+    def __init__(self, tolerance: int = 0) -> None:
+        self.tolerance = tolerance
+
+    def encode(self, series: pd.Series) -> np.ndarray:
+        return pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def scores(self, encoded1, pos1, encoded2, pos2) -> np.ndarray:
+        diff = np.abs(encoded1[pos1] - encoded2[pos2])
+        return 100 * np.clip(1 - diff / (self.tolerance + 1), 0, 1)
+
+    def describe(self) -> str:
+        return f"int, year_tolerance {self.tolerance}" if self.tolerance else self.name
+
+
+class HashComparator(Comparator):
+    """Values that either are equal (100) or not (0), compared as 64-bit hashes."""
+
+    def encode(self, series: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        values = self.normalize(series)
+        missing = values.isna().to_numpy()
+        hashes = pd.util.hash_array(values.fillna("").to_numpy(dtype=object))
+        return hashes, missing
+
+    def normalize(self, series: pd.Series) -> pd.Series:
+        raise NotImplementedError
+
+    def scores(self, encoded1, pos1, encoded2, pos2) -> np.ndarray:
+        (hashes1, missing1), (hashes2, missing2) = encoded1, encoded2
+        scores = np.where(hashes1[pos1] == hashes2[pos2], 100.0, 0.0)
+        scores[missing1[pos1] | missing2[pos2]] = np.nan
+        return scores
+
+
+class ExactComparator(HashComparator):
+    """Case-insensitive equality of the stripped values."""
+
+    name = "exact"
+
+    def normalize(self, series: pd.Series) -> pd.Series:
+        values = series.astype("string").str.strip().str.casefold()
+        return values.mask(values == "")
+
+
+class DoiComparator(HashComparator):
+    """Equality of identifiers without resolver prefixes, see `candidates.normalize_identifiers`."""
+
+    name = "doi"
+
+    def normalize(self, series: pd.Series) -> pd.Series:
+        return candidates.normalize_identifiers(series)
+
+
+class TokenSets(object):
+    """
+    Sets of token hashes of a column in CSR layout: the tokens of row i are
+    hashes[indptr[i] : indptr[i + 1]], unique within a row.
+    """
+
+    def __init__(self, sets: list[set[str]]) -> None:
+        lengths = np.array([len(tokens) for tokens in sets], dtype=np.int64)
+        self.indptr = np.zeros(len(sets) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.indptr[1:])
+        tokens = [token for tokens in sets for token in tokens]
+        self.hashes = pd.util.hash_array(np.array(tokens, dtype=object))
+
+    def lengths(self, pos: np.ndarray) -> np.ndarray:
+        return self.indptr[pos + 1] - self.indptr[pos]
+
+    def gather(self, pos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Token hashes of the rows at pos, with the index into pos each token belongs to."""
+        starts = self.indptr[pos]
+        lengths = self.lengths(pos)
+        owner = np.repeat(np.arange(len(pos)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.hashes[np.repeat(starts, lengths) + offsets], owner
+
+
+def intersections(sets1: TokenSets, pos1: np.ndarray, sets2: TokenSets, pos2: np.ndarray) -> np.ndarray:
+    """Sizes of the intersections of the token sets of the row pairs (pos1[i], pos2[i])."""
+    tokens1, owner1 = sets1.gather(pos1)
+    tokens2, owner2 = sets2.gather(pos2)
+    tokens = np.concatenate([tokens1, tokens2])
+    owner = np.concatenate([owner1, owner2])
+    order = np.lexsort((tokens, owner))
+    tokens, owner = tokens[order], owner[order]
+    # tokens are unique within a set, so a token repeated within a pair is shared by both sets
+    shared = (owner[1:] == owner[:-1]) & (tokens[1:] == tokens[:-1])
+    return np.bincount(owner[1:][shared], minlength=len(pos1))
+
+
+class SetJaccardComparator(Comparator):
+    """Lists of values (e.g. keywords) split on separator, scored by the Jaccard similarity of their normalized tokens."""
+
+    name = "set_jaccard"
+
+    def __init__(self, separator: str = ";") -> None:
+        self.separator = separator
+
+    def encode(self, series: pd.Series) -> TokenSets:
+        return TokenSets([self._tokens(value) for value in series])
+
+    def _tokens(self, value) -> set[str]:
+        if pd.isna(value):
+            return set()
+        tokens = (utils.default_process(token) for token in str(value).split(self.separator))
+        return {token for token in tokens if token}
+
+    def scores(self, encoded1, pos1, encoded2, pos2) -> np.ndarray:
+        shared = intersections(encoded1, pos1, encoded2, pos2)
+        union = encoded1.lengths(pos1) + encoded2.lengths(pos2) - shared
+        scores = 100 * shared / np.maximum(union, 1)
+        # empty sets are missing values
+        scores[(encoded1.lengths(pos1) == 0) | (encoded2.lengths(pos2) == 0)] = np.nan
+        return scores
+
+    def describe(self) -> str:
+        return f'set_jaccard, separator "{self.separator}"'
+
+
+class AuthorsComparator(Comparator):
+    """
+    Author lists, parsed once into sets of "surname initial" keys, so the order of the
+    authors and the spelling of given names do not matter. "Surname, Given", "Surname J."
+    and "Given Surname" names are understood. Pairs are scored by the overlap coefficient
+    (shared authors of the shorter list) or by the Jaccard similarity.
+    """
+
+    name = "authors"
+
+    def __init__(self, measure: str = "overlap", separator: str = AUTHOR_SEPARATORS) -> None:
+        if measure not in ("overlap", "jaccard"):
+            raise ValueError(f'Unknown authors measure "{measure}", expected overlap or jaccard.')
+        self.measure = measure
+        self.separator = separator
+
+    def encode(self, series: pd.Series) -> TokenSets:
+        # author lists repeat a lot (e.g. single authors), every distinct list is parsed once
+        parsed = {}
+        sets = []
+        for value in series:
+            if pd.isna(value):
+                sets.append(set())
+                continue
+            if value not in parsed:
+                parsed[value] = self._authors(str(value))
+            sets.append(parsed[value])
+        return TokenSets(sets)
+
+    def _authors(self, value: str) -> set[str]:
+        authors = set()
+        for name in re.split(self.separator, value):
+            key = author_key(name)
+            if key:
+                authors.add(key)
+        return authors
+
+    def scores(self, encoded1, pos1, encoded2, pos2) -> np.ndarray:
+        shared = intersections(encoded1, pos1, encoded2, pos2)
+        lengths1, lengths2 = encoded1.lengths(pos1), encoded2.lengths(pos2)
+        if self.measure == "overlap":
+            total = np.minimum(lengths1, lengths2)
+        else:
+            total = lengths1 + lengths2 - shared
+        scores = 100 * shared / np.maximum(total, 1)
+        scores[(lengths1 == 0) | (lengths2 == 0)] = np.nan
+        return scores
+
+    def describe(self) -> str:
+        return f"authors, {self.measure}"
+
+
+def author_key(name: str) -> str:
+    """Key of an author name: lowercase surname and first initial without accents, "" if empty."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char)).strip()
+    if not name:
+        return ""
+    if "," in name:
+        surname, _, given = name.partition(",")
+    else:
+        parts = name.split()
+        if len(parts) > 1 and INITIALS.match(parts[-1]):
+            surname, given = " ".join(parts[:-1]), parts[-1]
+        elif len(parts) > 1:
+            surname, given = parts[-1], " ".join(parts[:-1])
+        else:
+            surname, given = name, ""
+    surname = utils.default_process(surname)
+    given = utils.default_process(given)
+    return f"{surname} {given[:1]}".strip()
+
+
+def get_comparator(similarity: dict) -> Comparator | None:
+    """
+    Comparator of the `type` of a similarity config, None for text columns, which are compared
+    with rapidfuzz. A `year_tolerance` without a type implies `type: int`.
+    """
+    comparator_type = similarity.get("type", "int" if "year_tolerance" in similarity else "text")
+    if comparator_type == "text":
+        return None
+    if comparator_type == "int":
+        return IntComparator(similarity.get("year_tolerance", 0))
+    if comparator_type == "exact":
+        return ExactComparator()
+    if comparator_type == "doi":
+        return DoiComparator()
+    if comparator_type == "set_jaccard":
+        return SetJaccardComparator(similarity.get("separator", ";"))
+    if comparator_type == "authors":
+        return AuthorsComparator(
+            similarity.get("measure", "overlap"), similarity.get("separator", AUTHOR_SEPARATORS)
+        )
+    raise ValueError(
+        f"Unknown similarity type \"{comparator_type}\", expected one of {COMPARATOR_TYPES}."
+    )
@@ -0,0 +1,283 @@
+import itertools
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz
+
+from tesci import candidates, comparators, preprocessing, similarity
+from tesci.scripts.context import Config, DataSource
+from tesci.similarity import MergeSide, MergeState, VerificationStep
+
+# separates the two values of a pair when pairs are hashed
+PAIR_SEPARATOR = "\x1f"
+
+
+class PairScores(object):
+    """
+    Candidate pairs of a merge with the scores of every merge column, computed once. Scores
+    range from 0 to 100 and are NaN where a value is missing, text columns hold the full QRatio
+    (without score_cutoff), so the state of a pair can be derived for any `above` and `cutoff`.
+
+    `first` marks the pairs of the best df1 candidate of every df2 row, the other pairs are
+    the best df2 candidate of every df1 row, searched by df1 rows left unmerged.
+    """
+
+    def __init__(self, columns, side1, side2, key_pairs1, key_pairs2, df1_pos, df2_pos, first):
+        self.columns = columns
+        self.key_pairs1 = key_pairs1
+        self.key_pairs2 = key_pairs2
+        self.df1_pos = df1_pos
+        self.df2_pos = df2_pos
+        self.first = first
+        self.scores = {}
+        for column in columns:
+            comparator = comparators.get_comparator(column["similarity"])
+            if comparator is not None:
+                self.scores[column["into_"]] = comparator.scores(
+                    side1.encode(column["into_"], comparator),
+                    df1_pos,
+                    side2.encode(column["from_"], comparator),
+                    df2_pos,
+                )
+            else:
+                self.scores[column["into_"]] = _text_scores(
+                    side1.normalized.get(column["into_"]),
+                    df1_pos,
+                    side2.normalized.get(column["from_"]),
+                    df2_pos,
+                )
+
+    def states(self, thresholds: dict[str, tuple[float, float]]) -> np.ndarray:
+        """MergeState values of the pairs with the (above, cutoff) of every into_ column."""
+        states = np.full(len(self.df1_pos), MergeState.EXACT.value, dtype=np.int8)
+        for column in self.columns:
+            above, cutoff = thresholds[column["into_"]]
+            step = VerificationStep(column["from_"], column["into_"], above, cutoff)
+            np.maximum(states, step.classify_scores(self.scores[column["into_"]]), out=states)
+        return states
+
+    def merged(self, states: np.ndarray) -> np.ndarray:
+        """
+        Mask of the pairs merged by a merge classifying them as states, besides the exact key
+        pairs: the merged best candidates of df2 rows, then those of the df1 rows left
+        unmerged, like `similarity._match_directional`.
+        """
+        merged = states <= MergeState.SUGGESTED.value
+        merged1 = np.concatenate([self.key_pairs1, self.df1_pos[self.first & merged]])
+        return merged & (self.first | ~np.isin(self.df1_pos, merged1))
+
+
+def _text_scores(values1, pos1, values2, pos2) -> np.ndarray:
+    """QRatio of the normalized values of pairs, NaN where a value is missing."""
+    scores = np.full(len(pos1), np.nan)
+    for i, (p1, p2) in enumerate(zip(pos1.tolist(), pos2.tolist())):
+        value1, value2 = values1[p1], values2[p2]
+        if value1 is not None and value2 is not None:
+            scores[i] = fuzz.QRatio(value2, value1, processor=None)
+    return scores
+
+
+def pair_hashes(values1: list[str | None], values2: list[str | None]) -> np.ndarray:
+    """64-bit hash of every pair of values."""
+    return pd.util.hash_array(
+        np.array(
+            [f"{value1}{PAIR_SEPARATOR}{value2}" for value1, value2 in zip(values1, values2)],
+            dtype=object,
+        )
+    )
+
+
+def parse_sweep(entries: list[str], columns: list[dict]) -> dict[str, list[float]]:
+    """
+    Parses COLUMN=V1,V2,... sweep entries into the values of every into_ column, the column
+    being the from_ or into_ name of a merge column.
+    """
+    values = {}
+    for entry in entries:
+        name, separator, numbers = entry.partition("=")
+        if not separator or not numbers:
+            raise ValueError(f'Invalid sweep "{entry}", expected COLUMN=V1,V2,...')
+        column = similarity._find_merge_column(name.strip(), columns, "sweep")
+        try:
+            values[column["into_"]] = [float(number) for number in numbers.split(",")]
+        except ValueError:
+            raise ValueError(f'Invalid sweep "{entry}", values must be numbers.') from None
+    return values
+
+
+def evaluate(
+    sources: list[Path],
+    gold: Path,
+    above: list[str],
+    cutoff: list[str],
+    gold_columns: tuple[str, str] | None = None,
+    stage: int | None = None,
+    workers: int = 1,
+    dest: Path | None = None,
+) -> pd.DataFrame | None:
+    """
+    Evaluates merge thresholds against gold pairs. The candidate pairs of the merge are
+    searched and scored once, then every combination of the swept `above` and `cutoff` values
+    (the config values of columns that are not swept) is classified over the stored scores.
+
+    The gold file lists the true matches, one per row, by the reference values of the first
+    and the second source (gold_columns, by default the into_ and from_ names of the reference
+    column). Pairs are compared on their preprocessed, normalized reference values.
+
+    Prints and saves to config-evaluation the precision, recall and F1 of every combination,
+    the time it took to classify and merge the scored pairs (`classify seconds`) and that time
+    plus an equal share of the one-off search and scoring (`merge seconds`).
+    """
+    config = Config()
+    if "similarity_config" not in config.content.get("join", {}).keys():
+        logging.info(
+            "No similarity_config to apply to the dataset. Are you using a config file that has similarity_config?"
+        )
+        return None
+    if len(sources) != 2:
+        raise ValueError("Evaluating thresholds needs exactly two sources.")
+    merge_config = similarity._get_merge_config(config, stage)
+    if merge_config.get("one_to_one", None) is not None:
+        raise ValueError("The one_to_one merge option is not supported when evaluating thresholds.")
+    columns = merge_config["columns"]
+    for column in columns:
+        column["from_"] = column["from_"].lower()
+        column["into_"] = column["into_"].lower()
+    sweep_above = parse_sweep(above, columns)
+    sweep_cutoff = parse_sweep(cutoff, columns)
+
+    started = time.perf_counter()
+    # outputs are not saved, only the merge columns are read
+    df1 = similarity._load_source(
+        sources[0], similarity._merge_source_columns(config, merge_config, "into_")
+    )
+    df2 = similarity._load_source(
+        sources[1], similarity._merge_source_columns(config, merge_config, "from_")
+    )
+    df1.rename(columns=str.lower, inplace=True)
+    df2.rename(columns=str.lower, inplace=True)
+    if config.content["join"]["similarity_config"]["merge"].get("drop_duplicates"):
+        df1.drop_duplicates(inplace=True)
+        df2.drop_duplicates(inplace=True)
+    similarity._preprocess_sources(columns, df1, df2, workers)
+    if merge_config.get("dedup"):
+        df1 = similarity.deduplicate(df1, columns, "into_", merge_config, workers)
+        df2 = similarity.deduplicate(df2, columns, "from_", merge_config, workers)
+
+    reference_column = similarity._get_reference_column(columns)
+    side1 = MergeSide.create(df1, reference_column["into_"])
+    side2 = MergeSide.create(df2, reference_column["from_"])
+    side1.ngram = side2.ngram = similarity._get_ngram_index(merge_config)
+    block_on = similarity._get_block_on(merge_config, columns)
+    if block_on:
+        windows = [entry["window"] for entry in block_on]
+        for side, name in ((side1, "into_"), (side2, "from_")):
+            side.keys = similarity._get_block_keys(side.df, block_on, name)
+            side.index = candidates.BlockIndex(side.keys, windows)
+    key_pairs1, key_pairs2 = similarity._match_exact_keys(
+        df1, df2, similarity._get_exact_keys(merge_config, columns)
+    )
+    side1.exclude(key_pairs1)
+    side2.exclude(key_pairs2)
+
+    # the best candidates do not depend on the thresholds: df1 rows are searched whether or
+    # not they get merged, and their pairs only count when they are left unmerged
+    unmatched2 = np.setdiff1d(np.arange(len(df2)), key_pairs2)
+    best1, _ = similarity._search_candidates(side2, unmatched2, side1, workers)
+    unmatched1 = np.setdiff1d(np.arange(len(df1)), key_pairs1)
+    best2, _ = similarity._search_candidates(side1, unmatched1, side2, workers)
+    df1_pos = np.concatenate([best1, unmatched1])
+    df2_pos = np.concatenate([unmatched2, best2])
+    first = np.arange(len(df1_pos)) < len(unmatched2)
+    found = (df1_pos >= 0) & (df2_pos >= 0)
+    scores = PairScores(
+        columns, side1, side2, key_pairs1, key_pairs2, df1_pos[found], df2_pos[found], first[found]
+    )
+    scoring_seconds = time.perf_counter() - started
+    print(f"Scored {found.sum()} candidate pairs in {scoring_seconds:.2f}s")
+
+    gold_pairs = _gold_hashes(gold, reference_column, gold_columns)
+    references1 = side1.normalized.get(reference_column["into_"])
+    references2 = side2.normalized.get(reference_column["from_"])
+
+    def hashes(pairs1, pairs2):
+        return pair_hashes([references1[pos] for pos in pairs1], [references2[pos] for pos in pairs2])
+
+    # pairs are hashed once, configurations select from them
+    candidate_hashes = hashes(scores.df1_pos, scores.df2_pos)
+    key_hashes = hashes(key_pairs1, key_pairs2)
+
+    names = [column["into_"] for column in columns]
+    options = {
+        name: list(
+            itertools.product(
+                sweep_above.get(name, [column["similarity"]["above"]]),
+                sweep_cutoff.get(name, [column["similarity"]["cutoff"]]),
+            )
+        )
+        for name, column in zip(names, columns)
+    }
+    combinations = list(itertools.product(*(options[name] for name in names)))
+    rows = []
+    for combination in combinations:
+        started = time.perf_counter()
+        thresholds = dict(zip(names, combination))
+        merged = scores.merged(scores.states(thresholds))
+        merged_hashes = np.unique(np.concatenate([key_hashes, candidate_hashes[merged]]))
+        true_positives = int(np.isin(merged_hashes, gold_pairs).sum())
+        precision = true_positives / len(merged_hashes) if len(merged_hashes) else 0.0
+        recall = true_positives / len(gold_pairs) if len(gold_pairs) else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        row = {}
+        for name in names:
+            row[f"{name} above"], row[f"{name} cutoff"] = thresholds[name]
+        row.update(
+            {
+                "merged": len(merged_hashes),
+                "precision": precision,
+                "recall": recall,
+                "f1": f1,
+                "classify seconds": time.perf_counter() - started,
+            }
+        )
+        row["merge seconds"] = row["classify seconds"] + scoring_seconds / len(combinations)
+        rows.append(row)
+
+    # only the swept thresholds tell configurations apart
+    swept = [f"{name} above" for name in sweep_above] + [f"{name} cutoff" for name in sweep_cutoff]
+    results = pd.DataFrame(rows)
+    results = results[
+        swept + ["merged", "precision", "recall", "f1", "classify seconds", "merge seconds"]
+    ]
+    print(results.to_string(index=False))
+    DataSource.save_to_file(
+        results,
+        config,
+        name_override="config-evaluation.xls",
+        path_override=Path(dest) if dest is not None else None,
+    )
+    return results
+
+
+def _gold_hashes(gold: Path, reference_column: dict, gold_columns: tuple[str, str] | None) -> np.ndarray:
+    """Hashes of the gold pairs, by the preprocessed and normalized reference values."""
+    if gold_columns is None:
+        gold_columns = (reference_column["into_"], reference_column["from_"])
+    column1, column2 = (column.lower() for column in gold_columns)
+    df = similarity._load_source(gold, [column1, column2])
+    df.rename(columns=str.lower, inplace=True)
+    for column in (column1, column2):
+        if column not in df.columns:
+            raise ValueError(f'Gold file {gold} has no column "{column}".')
+    gold_pairs = pd.DataFrame({"value1": df[column1].astype(str), "value2": df[column2].astype(str)})
+    if reference_column.get("preprocess", None) is not None:
+        preprocessor = preprocessing.Preprocessor(reference_column["preprocess"])
+        preprocessing.apply_preprocessors(
+            [(gold_pairs, "value1", preprocessor), (gold_pairs, "value2", preprocessor)]
+        )
+    return np.unique(
+        pair_hashes(candidates.normalize(gold_pairs["value1"]), candidates.normalize(gold_pairs["value2"]))
+    )
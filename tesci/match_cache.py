@@ -0,0 +1,108 @@
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tesci.scripts.context import CONFIG_HOME
+
+CACHE_DIR = Path(CONFIG_HOME) / "cache" / "matches"
+
+
+def row_hashes(columns: dict[str, list[str | None]]) -> np.ndarray:
+    """64-bit hash per row over normalized column values."""
+    return pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+
+class MatchCache(object):
+    """
+    Candidates and states of a previous merge, stored under .tesci/cache/matches/. Rows are
+    identified by hashes of their normalized merge column values, and every merge config gets
+    its own cache, so an entry stays valid as long as both of its rows are unchanged.
+
+    For every search direction the cache keeps the best candidate and score of each query and
+    the set of choices it was searched against. The states of classified pairs are shared by
+    both directions. Saving keeps only the entries of the current merge, so rows that no
+    longer exist are evicted.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.directory = Path.cwd() / CACHE_DIR / name
+        self._best = {}
+        self._choices = {}
+        self._states = {}
+        self._next_best = {}
+        self._next_choices = {}
+        self._next_states = {}
+        if self.directory.exists():
+            self._load()
+
+    @classmethod
+    def for_config(cls, merge_settings: dict) -> "MatchCache":
+        """Opens the cache of a merge config (columns, blocking, exact keys, ...)."""
+        content = json.dumps(merge_settings, sort_keys=True, default=str)
+        return cls(hashlib.sha1(content.encode("utf-8")).hexdigest()[:16])
+
+    def best(self, direction: str, query: int) -> tuple[int | None, float] | None:
+        """Best candidate hash (None when there was no candidate) and score of a query."""
+        return self._best.get(direction, {}).get(query, None)
+
+    def choices(self, direction: str) -> set[int]:
+        return self._choices.get(direction, set())
+
+    def state(self, df1_row: int, df2_row: int) -> int | None:
+        return self._states.get((df1_row, df2_row), None)
+
+    def update_search(self, direction, queries, candidates, scores, choices) -> None:
+        """Records the best candidates of a search, candidates of None mean no candidate."""
+        self._next_best[direction] = {
+            query: (candidate, score) for query, candidate, score in zip(queries, candidates, scores)
+        }
+        self._next_choices[direction] = set(choices)
+
+    def update_states(self, df1_rows, df2_rows, states) -> None:
+        self._next_states.update(zip(zip(df1_rows, df2_rows), states))
+
+    def save(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        best = [
+            (direction, query, candidate is not None, candidate or 0, score)
+            for direction, entries in self._next_best.items()
+            for query, (candidate, score) in entries.items()
+        ]
+        pd.DataFrame(
+            best, columns=["direction", "query", "found", "candidate", "score"]
+        ).astype({"query": np.uint64, "candidate": np.uint64}).to_parquet(
+            self.directory / "best.parquet", index=False
+        )
+        choices = [
+            (direction, choice)
+            for direction, entries in self._next_choices.items()
+            for choice in entries
+        ]
+        pd.DataFrame(choices, columns=["direction", "choice"]).astype(
+            {"choice": np.uint64}
+        ).to_parquet(self.directory / "choices.parquet", index=False)
+        states = [(df1_row, df2_row, state) for (df1_row, df2_row), state in self._next_states.items()]
+        pd.DataFrame(states, columns=["df1", "df2", "state"]).astype(
+            {"df1": np.uint64, "df2": np.uint64, "state": np.int8}
+        ).to_parquet(self.directory / "states.parquet", index=False)
+
+    def _load(self) -> None:
+        best = pd.read_parquet(self.directory / "best.parquet")
+        for direction, entries in best.groupby("direction"):
+            self._best[direction] = {
+                int(query): (int(candidate) if found else None, float(score))
+                for query, found, candidate, score in zip(
+                    entries["query"], entries["found"], entries["candidate"], entries["score"]
+                )
+            }
+        choices = pd.read_parquet(self.directory / "choices.parquet")
+        for direction, entries in choices.groupby("direction"):
+            self._choices[direction] = set(int(choice) for choice in entries["choice"])
+        states = pd.read_parquet(self.directory / "states.parquet")
+        self._states = {
+            (int(df1_row), int(df2_row)): int(state)
+            for df1_row, df2_row, state in zip(states["df1"], states["df2"], states["state"])
+        }
@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+UNICODE_FORMS = ["NFC", "NFKC", "NFD", "NFKD"]
+
+
+class Preprocessor(object):
+    """
+    The `preprocess` options of a merge column compiled into a single transform per value:
+
+    - `replace`: mapping of whole values to their replacement;
+    - `unicode`: Unicode normalization form (NFC, NFKC, NFD or NFKD);
+    - `truncate_after`: separators, everything from the first separator on is cut off;
+    - `remove`: substrings to remove;
+    - `casefold`: case-insensitive form of the value.
+
+    The options run in this order. `truncate_after` and `remove` are compiled into one
+    regular expression, so they are applied in a single scan of the value.
+    """
+
+    def __init__(self, preprocess_config: dict) -> None:
+        self.replace = preprocess_config.get("replace", None) or {}
+        self.unicode = preprocess_config.get("unicode", None)
+        if self.unicode is not None and self.unicode not in UNICODE_FORMS:
+            raise ValueError(
+                f"Unknown unicode normalization \"{self.unicode}\", expected one of {UNICODE_FORMS}."
+            )
+        self.casefold = bool(preprocess_config.get("casefold", False))
+        alternatives = []
+        truncate_after = preprocess_config.get("truncate_after", None) or []
+        if truncate_after:
+            alternatives.append(
+                "(?:" + "|".join(re.escape(separator) for separator in truncate_after) + r")[\s\S]*"
+            )
+        remove = preprocess_config.get("remove", None) or []
+        alternatives.extend(re.escape(value) for value in remove)
+        self.pattern = re.compile("|".join(alternatives)) if alternatives else None
+
+    def transform(self, value):
+        """Preprocessed value, values that are not strings are returned unchanged."""
+        if not isinstance(value, str):
+            return value
+        value = self.replace.get(value, value)
+        if self.unicode is not None:
+            value = unicodedata.normalize(self.unicode, value)
+        if self.pattern is not None:
+            value = self.pattern.sub("", value)
+        if self.casefold:
+            value = value.casefold()
+        return value
+
+    def transform_values(self, values: list) -> list:
+        return [self.transform(value) for value in values]
+
+
+def apply_preprocessors(jobs: list[tuple[pd.DataFrame, str, Preprocessor]], workers: int = 1) -> None:
+    """
+    Preprocesses the columns of the (frame, column, preprocessor) jobs in place. Every
+    distinct value of a column is transformed once, with several workers the columns are
+    transformed in parallel processes.
+    """
+    factorized = [pd.factorize(df[col]) for df, col, _ in jobs]
+    uniques = [list(values) for _, values in factorized]
+    preprocessors = [preprocessor for _, _, preprocessor in jobs]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            transformed = list(
+                executor.map(Preprocessor.transform_values, preprocessors, uniques)
+            )
+    else:
+        transformed = [
+            preprocessor.transform_values(values)
+            for preprocessor, values in zip(preprocessors, uniques)
+        ]
+    for (df, col, _), (codes, _), values in zip(jobs, factorized, transformed):
+        # missing values (code -1) are kept as they are
+        result = df[col].to_numpy(dtype=object, copy=True)
+        present = codes >= 0
+        result[present] = np.array(values + [None], dtype=object)[codes[present]]
+        dtype = df[col].dtype
+        df[col] = pd.Series(result, index=df.index)
+        if isinstance(dtype, pd.StringDtype):
+            df[col] = df[col].astype(dtype)
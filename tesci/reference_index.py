@@ -0,0 +1,160 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tesci import candidates, columnstore
+from tesci.scripts.context import CONFIG_HOME, file_hash
+
+INDEX_DIR = Path(CONFIG_HOME) / "index"
+MANIFEST_NAME = "index.json"
+# changes when the files of an index change, indexes of other versions are rebuilt
+INDEX_VERSION = 2
+
+
+class ReferenceIndex(object):
+    """
+    Prepared first source of a merge, stored under .tesci/index/ so repeated merges against
+    the same corpus skip preprocessing, deduplicating and normalizing it and building its
+    n-gram index. The source file is still read, the merge outputs keep all of its columns.
+
+    The index holds the row labels of the source, the preprocessed values of the columns
+    preprocessing changes, the groups of duplicate rows if the merge deduplicates the source,
+    and, for the deduplicated rows, the normalized merge columns (see `columnstore`) and the
+    n-gram index of the reference column if the merge uses one. Normalized columns and the
+    n-gram index are memory-mapped when opened.
+
+    An index is tied to the content of its source file and to the merge settings it was built
+    with. It is current while the file keeps its size and modification time, otherwise the
+    file is hashed again, so touching a file does not invalidate its index.
+    """
+
+    def __init__(self, src: Path) -> None:
+        self.src = Path(src).resolve()
+        name = hashlib.sha1(str(self.src).encode("utf-8")).hexdigest()[:8]
+        self.directory = Path.cwd() / INDEX_DIR / f"{self.src.stem}-{name}"
+
+    @property
+    def columns_directory(self) -> Path:
+        return self.directory / "columns"
+
+    @property
+    def ngram_directory(self) -> Path:
+        return self.directory / "ngram"
+
+    def exists(self) -> bool:
+        return (self.directory / MANIFEST_NAME).exists()
+
+    def _read_manifest(self) -> dict:
+        with open(self.directory / MANIFEST_NAME, "r") as manifest_file:
+            return json.load(manifest_file)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        with open(self.directory / MANIFEST_NAME, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+    def _file_state(self) -> dict:
+        stat = self.src.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @staticmethod
+    def settings_hash(settings: dict) -> str:
+        content = json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def is_current(self, settings: dict, labels: pd.Index | None = None) -> bool:
+        """
+        Whether the index was built from the current content of the source with settings, and,
+        if labels are given, for a frame with these row labels (before deduplication).
+        """
+        if not self.exists():
+            return False
+        manifest = self._read_manifest()
+        if manifest.get("version") != INDEX_VERSION or manifest["settings"] != self.settings_hash(settings):
+            return False
+        state = self._file_state()
+        if state != manifest["file"]:
+            if state["size"] != manifest["file"]["size"] or file_hash(self.src) != manifest["sha1"]:
+                return False
+            # same content, only the modification time changed
+            manifest["file"] = state
+            self._write_manifest(manifest)
+        if labels is not None:
+            stored = np.load(self.directory / "labels.npy", mmap_mode="r")
+            if not np.array_equal(stored, labels.to_numpy()):
+                return False
+        return True
+
+    def build(
+        self,
+        df: pd.DataFrame,
+        prepared: pd.DataFrame,
+        columns: list[str],
+        reference_column: str,
+        settings: dict,
+        ngram: dict | None = None,
+        groups: np.ndarray | None = None,
+    ) -> None:
+        """
+        Indexes the source. prepared is the preprocessed frame of the source before
+        deduplication, of the columns preprocessing changes, and groups the group (first row
+        position) of each of its rows if duplicates were collapsed. df is the frame the merge
+        compares, whose columns are normalized and, with ngram settings, whose reference column
+        is indexed. Labels other than integers are not supported, sources are loaded with a
+        RangeIndex.
+        """
+        if self.directory.exists():
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True)
+        prepared.to_parquet(self.directory / "prepared.parquet", index=False)
+        np.save(self.directory / "labels.npy", prepared.index.to_numpy(dtype=np.int64))
+        if groups is not None:
+            np.save(self.directory / "groups.npy", groups)
+        normalized = candidates.NormalizedColumns(df)
+        columnstore.write_columns(
+            self.columns_directory, {column: normalized.get(column) for column in columns}
+        )
+        if ngram is not None:
+            candidates.NgramIndex(
+                normalized.get(reference_column), n=ngram["n"], max_df=ngram["max_df"]
+            ).save(self.ngram_directory)
+        # the manifest is written last, an interrupted build leaves no index behind
+        self._write_manifest(
+            {
+                "version": INDEX_VERSION,
+                "source": str(self.src),
+                "file": self._file_state(),
+                "sha1": file_hash(self.src),
+                "settings": self.settings_hash(settings),
+                "rows": len(df),
+                "columns": columns,
+                "ngram": ngram is not None,
+            }
+        )
+
+    def prepare(self, df: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray | None]:
+        """
+        df, a frame of the current source with the labels of the index, with the stored
+        preprocessed values, and the stored groups of duplicate rows (None without any).
+        """
+        prepared = pd.read_parquet(self.directory / "prepared.parquet")
+        for column in prepared.columns:
+            df[column] = prepared[column].to_numpy()
+        groups = self.directory / "groups.npy"
+        return df, np.load(groups) if groups.exists() else None
+
+    def open(self, df: pd.DataFrame) -> tuple[candidates.NormalizedColumns, candidates.NgramIndex | None]:
+        """
+        Normalized columns of the indexed frame df, the indexed columns memory-mapped and any
+        other column normalized on first use, and the n-gram index if there is one.
+        """
+        mapped = columnstore.MappedColumns(self.columns_directory)
+        manifest = self._read_manifest()
+        normalized = candidates.NormalizedColumns(
+            df, {column: mapped.get(column) for column in manifest["columns"]}
+        )
+        ngram_index = candidates.NgramIndex.load(self.ngram_directory) if manifest["ngram"] else None
+        return normalized, ngram_index
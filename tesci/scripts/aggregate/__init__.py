@@ -1,7 +1,5 @@
 import click
 
-import tesci.transformations as transformations
-
 AGGREGATE_FUNCTIONS = ["count", "distinct", "max", "min", "sum", "avg"]
 
 
@@ -28,6 +26,8 @@ def aggregate(function, columns, group, alias):
     """Run an aggregate function as it's typically understood by SQL semantics.
     Currently supported functions are: count, distinct, max, min, sum, avg
     """
+    import tesci.transformations as transformations
+
     message = f"Successfully ran function {function.upper()}"
     if not group and not columns:
         raise click.UsageError("You must specify either a column or a group.")
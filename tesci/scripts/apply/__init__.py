@@ -2,12 +2,12 @@ import os
 
 import click
 
-import tesci.transformations as transformations
-
 
 @click.command()
 def apply():
     """Apply the changes to the destination dataset"""
+    import tesci.transformations as transformations
+
     # transformations.preview()
 
     is_ci = os.environ.get("TESCI_RUN_FROM_CI", None)
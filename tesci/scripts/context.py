@@ -1,12 +1,89 @@
+from collections import OrderedDict
+import hashlib
 import os
 from pathlib import Path
 
 import attrs
+import numpy as np
 import pandas as pd
 import yaml
 
 CONFIG_HOME = ".tesci"
 CONFIG_NAME = os.environ.get("TESCI_CONFIG_NAME") or "config.yml"
+# memory the frames kept by the frame cache may take, in bytes
+FRAME_CACHE_BYTES = int(os.environ.get("TESCI_FRAME_CACHE_BYTES") or 1024**3)
+# columnar copies of the sources that are slow to parse, see `Reader`
+SIDECAR_DIR = Path(CONFIG_HOME) / "cache" / "frames"
+SIDECAR_SUFFIXES = [".xlsx", ".xls", ".csv"]
+# bytes read at a time when hashing a file
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_hash(path: Path) -> str:
+    """SHA-1 of the content of a file."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_state(path: Path) -> tuple[str, int, int]:
+    """Resolved path, size and modification time of a file, which change when it is rewritten."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    return str(path), stat.st_size, stat.st_mtime_ns
+
+
+class FrameCache(object):
+    """
+    Frames parsed from files, shared by every reader of the process. Entries are keyed by the
+    `file_state` of the file (and the read options), so a file that changes on disk is parsed
+    again, and the least recently used frames are evicted once the frames take more than
+    budget bytes. Readers get a copy of the cached frame, which they are free to modify.
+    """
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self.size = 0
+        self._frames = OrderedDict()
+
+    def get(self, path: Path, parse, options: tuple = ()) -> pd.DataFrame:
+        """Frame of path parsed with parse (called without arguments) on a miss."""
+        key = file_state(path) + options
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return self._frames[key][0].copy()
+        df = parse()
+        # older versions of the file will not be asked for again, other reads of this version
+        # (e.g. of other columns) are kept
+        state = key[:3]
+        for stale in [entry for entry in self._frames if entry[0] == state[0] and entry[:3] != state]:
+            self._evict(stale)
+        size = int(df.memory_usage(deep=True).sum())
+        if size <= self.budget:
+            self._frames[key] = (df, size)
+            self.size += size
+            while self.size > self.budget:
+                self._evict(next(iter(self._frames)))
+            return df.copy()
+        return df
+
+    def peek(self, path: Path) -> pd.DataFrame | None:
+        """Cached frame of all columns of path, not to be modified, None if there is none."""
+        entry = self._frames.get(file_state(path), None)
+        return entry[0] if entry is not None else None
+
+    def _evict(self, key) -> None:
+        _, size = self._frames.pop(key)
+        self.size -= size
+
+    def clear(self) -> None:
+        self._frames.clear()
+        self.size = 0
+
+
+FRAMES = FrameCache(FRAME_CACHE_BYTES)
 
 
 class Data(object):
@@ -32,36 +109,201 @@ class Data(object):
 
 
 class Reader(Data):
+    """
+    Reads a source, parsing the file once per process (see `FrameCache`). Excel and CSV files
+    are parsed once for good: their frame is kept as an uncompressed Arrow IPC sidecar under
+    .tesci/cache/frames/, named by the hash of the file content, and later reads memory-map
+    the sidecar instead. Frames Arrow cannot store (e.g. columns mixing numbers and text) are
+    parsed every time.
+    """
+
     def __init__(self, path: str = None) -> None:
         super().__init__(path)
 
-        self.df = self.load()
-
-    def load(self) -> pd.DataFrame:
+    @property
+    def df(self) -> pd.DataFrame:
+        return self.load()
+
+    def load(self, columns: list[str] | None = None) -> pd.DataFrame:
+        """
+        Frame of the source, only of the columns (case insensitive) if given, so that other
+        columns are neither parsed nor kept in memory. Unknown columns are ignored.
+        """
+        if columns is None:
+            return FRAMES.get(self.path, self._parse)
+        wanted = tuple(sorted({column.lower() for column in columns}))
+        return FRAMES.get(self.path, lambda: self._parse(set(wanted)), ("columns",) + wanted)
+
+    def _parse(self, wanted: set[str] | None = None) -> pd.DataFrame:
+        if self.path.suffix not in SIDECAR_SUFFIXES or not (Path.cwd() / CONFIG_HOME).is_dir():
+            return self._read_file(wanted)
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.ipc as ipc
+
+        prefix = self._sidecar_prefix()
+        sidecar = Path.cwd() / SIDECAR_DIR / f"{prefix}{file_hash(self.path)}.arrow"
+        if sidecar.exists():
+            names = None
+            if wanted is not None:
+                with pa.memory_map(str(sidecar)) as source:
+                    names = _selected(ipc.open_file(source).schema.names, wanted)
+            df = feather.read_table(sidecar, columns=names, memory_map=True).to_pandas()
+            # Arrow nulls come back as None, the parsers give NaN
+            for col in df.columns[df.dtypes == object]:
+                df[col] = df[col].mask(df[col].isna(), np.nan)
+            return df
+        # the sidecar holds every column, later reads select from it
+        df = self._read_file()
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        # sidecars of previous versions of the file
+        for previous in sidecar.parent.glob(f"{prefix}*.arrow"):
+            previous.unlink()
+        partial = sidecar.with_suffix(".partial")
+        try:
+            feather.write_feather(df, partial, compression="uncompressed")
+            partial.replace(sidecar)
+        except (TypeError, ValueError):
+            # not representable in Arrow
+            partial.unlink(missing_ok=True)
+        return df[_selected(df.columns, wanted)] if wanted is not None else df
+
+    def _sidecar_prefix(self) -> str:
+        # one sidecar per source file, the content hash tells whether it is current
+        path_hash = hashlib.sha1(str(self.path.resolve()).encode("utf-8")).hexdigest()[:8]
+        return f"{self.path.stem}-{path_hash}-"
+
+    def _read_file(self, wanted: set[str] | None = None) -> pd.DataFrame:
+        usecols = (lambda column: str(column).lower() in wanted) if wanted is not None else None
         match self.path.suffix:
             case ".xlsx" | ".xls":
-                reader = pd.read_excel(self.path)
+                reader = pd.read_excel(self.path, usecols=usecols)
             case ".csv":
-                reader = pd.read_csv(self.path)
+                reader = pd.read_csv(self.path, usecols=usecols)
+            case ".parquet":
+                names = _selected(self.columns(), wanted) if wanted is not None else None
+                reader = pd.read_parquet(self.path, columns=names)
             case _:
                 raise ValueError(f"File type '{self.path.suffix}' not supported.")
         return reader
 
+    def columns(self) -> list[str]:
+        """Column names of the source, reading only its header unless it is parsed already."""
+        df = FRAMES.peek(self.path)
+        if df is not None:
+            return df.columns.tolist()
+        match self.path.suffix:
+            case ".xlsx" | ".xls":
+                return pd.read_excel(self.path, nrows=0).columns.tolist()
+            case ".csv":
+                return pd.read_csv(self.path, nrows=0).columns.tolist()
+            case ".parquet":
+                import pyarrow.parquet as pq
+
+                schema = pq.read_schema(self.path)
+                index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+                return [name for name in schema.names if name not in index_columns]
+            case _:
+                raise ValueError(f"File type '{self.path.suffix}' not supported.")
+
+    def row_count(self) -> int:
+        """
+        Number of rows of the source, from the Parquet or sidecar metadata when there is no
+        parsed frame, and otherwise by reading its first column only.
+        """
+        df = FRAMES.peek(self.path)
+        if df is not None:
+            return len(df)
+        if self.path.suffix == ".parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetFile(self.path).metadata.num_rows
+        if self.path.suffix not in SIDECAR_SUFFIXES:
+            raise ValueError(f"File type '{self.path.suffix}' not supported.")
+        sidecar = Path.cwd() / SIDECAR_DIR / f"{self._sidecar_prefix()}{file_hash(self.path)}.arrow"
+        if sidecar.exists():
+            import pyarrow as pa
+            import pyarrow.ipc as ipc
+
+            with pa.memory_map(str(sidecar)) as source:
+                reader = ipc.open_file(source)
+                return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+        return len(self._read_file({str(self.columns()[0]).lower()}))
+
+
+def _selected(names: list[str], wanted: set[str]) -> list[str]:
+    """Names (in their order) whose lowercase form is wanted."""
+    return [name for name in names if str(name).lower() in wanted]
+
+
+class ChunkReader(Data):
+    """Reads a source in chunks of rows, without loading all of it."""
+
+    def __init__(self, path: str = None, chunk_size: int = 100_000) -> None:
+        super().__init__(path)
+        self.chunk_size = chunk_size
+
+    def chunks(self, columns: list[str] | None = None):
+        """Frames of at most chunk_size rows, optionally of the columns (case insensitive) only."""
+        wanted = {column.lower() for column in columns} if columns is not None else None
+        match self.path.suffix:
+            case ".csv":
+                usecols = (lambda column: column.lower() in wanted) if wanted is not None else None
+                yield from pd.read_csv(self.path, chunksize=self.chunk_size, usecols=usecols)
+            case ".parquet":
+                import pyarrow.parquet as pq
+
+                parquet_file = pq.ParquetFile(self.path)
+                names = parquet_file.schema_arrow.names
+                if wanted is not None:
+                    names = [name for name in names if name.lower() in wanted]
+                for batch in parquet_file.iter_batches(batch_size=self.chunk_size, columns=names):
+                    yield batch.to_pandas()
+            case _:
+                raise ValueError(f"File type '{self.path.suffix}' cannot be read in chunks.")
+
 
 class DataSource(object):
+    """
+    Source of the config, either a single file or the sources of a join. Sources are lazy
+    handles: nothing is parsed until a frame is asked for, so commands that only edit the
+    config or check the columns of the source stay fast.
+    """
+
     def __init__(self) -> None:
         self.join_sources = None
         self.config = Config()
         self.source: Data = self.load()
-        self._loaded = None
 
     @classmethod
     def get(cls):
-        return cls()
+        """
+        Data source of the current config, shared within the process until the config or one
+        of its source files changes.
+        """
+        config = Config()
+        key = (file_state(config.config_path),) + tuple(
+            file_state(path) for path in cls._source_paths(config) if path.exists()
+        )
+        if key not in _DATA_SOURCES:
+            _DATA_SOURCES.clear()
+            _DATA_SOURCES[key] = cls()
+        return _DATA_SOURCES[key]
+
+    @staticmethod
+    def _source_paths(config) -> list[Path]:
+        """Paths of the files the config reads, resolved like `Data` does."""
+        names = [(config.content.get("data", None) or {}).get("src", None)]
+        names.extend((config.content.get("join", None) or {}).get("src", None) or [])
+        return [
+            name if isinstance(name, Path) else Path.cwd() / Path(CONFIG_HOME) / Path(name)
+            for name in names
+            if name
+        ]
 
     def load(self) -> Data | list[Data]:
         """Loads the data source."""
-        source_path = self.config.content.get("data", None).get("src", None)
+        source_path = (self.config.content.get("data", None) or {}).get("src", None)
         join_sources = self.config.content.get("join", None)
         if not source_path and not join_sources:
             raise ValueError("No data source found in the config file.")
@@ -69,11 +311,11 @@ class DataSource(object):
             raise ValueError(
                 "You cannot specify both a data source and join sources in the config file."
             )
-        if join_sources.get("src", None) is not None:
+        if join_sources and join_sources.get("src", None) is not None:
             self.join_sources = JoinSources(
                 sources=[
                     JoinSource(
-                        Reader(join_source).load(),
+                        Reader(join_source),
                         join_sources.get("columns", None),
                     )
                     for join_source in join_sources["src"]
@@ -83,9 +325,7 @@ class DataSource(object):
             )
             return self.join_sources
         else:
-            reader = Reader(source_path)
-            self._loaded = list(reader.load())
-            return reader
+            return Reader(source_path)
 
     @classmethod
     def save_to_file(cls, df, config, name_override=None, path_override=None) -> None:
@@ -106,6 +346,8 @@ class DataSource(object):
                     df.to_excel(dest_path, index=False)
                 case ".csv":
                     df.to_csv(dest_path, index=False)
+                case ".parquet":
+                    df.to_parquet(dest_path, index=False)
                 case _:
                     raise ValueError(f"File type '{dest_path.suffix}' not supported.")
         except Exception as e:
@@ -126,6 +368,10 @@ class DataSource(object):
         return dest_path
 
 
+# data source of the last config asked for, see `DataSource.get`
+_DATA_SOURCES = {}
+
+
 class Config(object):
     def __init__(self) -> None:
         self.config_path = Path.cwd() / Path(CONFIG_HOME) / CONFIG_NAME
@@ -159,6 +405,29 @@ class Config(object):
         with open(config.config_path, "w") as yaml_file:
             yaml.safe_dump(config.content, yaml_file, default_flow_style=False)
 
+    def transformation_columns(self) -> list[str] | None:
+        """
+        Columns of the data source read by the transformations: the `include` columns, the
+        columns and groups of the `aggregate` entries and the `sort` keys. None when the
+        transformations keep every column, i.e. nothing is included and the frame is not
+        replaced by ungrouped aggregates.
+        """
+        include = self.content.get("include", None)
+        aggregations = self.content.get("aggregate", None) or []
+        if include is None and (
+            not aggregations
+            or any(aggregation.get("grouped") is not None for aggregation in aggregations)
+        ):
+            return None
+        columns = list(include or [])
+        for aggregation in aggregations:
+            for key in ("columns", "grouped"):
+                values = aggregation.get(key, None) or []
+                columns.extend([values] if isinstance(values, str) else values)
+        for keys in (self.content.get("sort", None) or {}).values():
+            columns.extend(keys)
+        return list(dict.fromkeys(columns))
+
     @property
     def dest_name(self) -> str:
         return self.content.get("data", None).get("dest", None)
@@ -184,14 +453,34 @@ class Config(object):
 
 
 class JoinSource(Data):
+    """
+    A source of a join, given as a frame or as a Reader that is parsed on first access to
+    `df`. `columns` are the columns the sources are joined on.
+    """
+
     def __init__(
         self,
-        df: pd.DataFrame,
+        source: pd.DataFrame | Reader,
         columns: list[str] | None,
     ) -> None:
-        self.df = df
+        self.reader = source if isinstance(source, Reader) else None
+        self._df = source if isinstance(source, pd.DataFrame) else None
         self.columns = columns
 
+    @property
+    def df(self) -> pd.DataFrame:
+        if self._df is None:
+            self._df = self.reader.load()
+        return self._df
+
+    def schema(self) -> list[str]:
+        """Column names of the source, without parsing it."""
+        return self._df.columns.tolist() if self._df is not None else self.reader.columns()
+
+    def row_count(self) -> int:
+        """Number of rows of the source, without parsing it (see `Reader.row_count`)."""
+        return len(self._df) if self._df is not None else self.reader.row_count()
+
 
 @attrs.define
 class RatioConfig:
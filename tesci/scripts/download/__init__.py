@@ -1,7 +1,5 @@
 import click
 
-import tesci.api.api as api
-
 
 @click.command()
 @click.option(
@@ -13,4 +11,6 @@ import tesci.api.api as api
 )
 def download(dest):
     """Download the data from the provider and save it to the destination"""
+    import tesci.api.api as api
+
     api.download(dest)
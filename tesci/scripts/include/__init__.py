@@ -1,7 +1,5 @@
 import click
 
-import tesci.transformations as transformations
-
 
 @click.command()
 @click.option(
@@ -12,4 +10,6 @@ import tesci.transformations as transformations
 )
 def include(columns):
     """Columns to include in the final dataset"""
+    import tesci.transformations as transformations
+
     transformations.include(columns=columns.split(","))
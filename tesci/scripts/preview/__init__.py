@@ -1,9 +1,9 @@
 import click
 
-import tesci.transformations as transformations
-
 
 @click.command()
 def preview():
     """Preview the changes that will be applied to the dataset"""
+    import tesci.transformations as transformations
+
     transformations.preview()
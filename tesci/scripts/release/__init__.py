@@ -1,12 +1,12 @@
 import click
 import os
 
-import tesci.release as publish
-
 
 @click.command()
 def release():
     """Publish the dataset to the repositories specified in the configuration file"""
+    import tesci.release as publish
+
     is_ci = os.environ.get("TESCI_RUN_FROM_CI", None)
     strategy = os.environ.get("TESCI_RELEASE_STRATEGY", None)
     if not is_ci:
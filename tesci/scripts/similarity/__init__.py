@@ -1,6 +1,5 @@
 import click
 from pathlib import Path
-import tesci.similarity as similarity
 
 
 @click.group(name="similarity")
@@ -21,22 +20,223 @@ def similarity_cli():
     default=None,
     help="Path to the destination of the combined data source",
 )
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes used to compare candidate rows and of threads used to search them (all cores with 1)",
+)
+@click.option(
+    "--keep-intermediates",
+    is_flag=True,
+    default=False,
+    help="Save the results of every stage of a multi-stage merge",
+)
+@click.option(
+    "--explain",
+    is_flag=True,
+    default=False,
+    help="Show how every stage finds and verifies candidate pairs, without merging",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Read the second source in chunks of this many rows and write the outputs as CSV",
+)
+@click.option(
+    "--cluster",
+    is_flag=True,
+    default=False,
+    help="Merge all sources in one pass, grouping records into entities of one record per source",
+)
 @similarity_cli.command()
-def merge(src, dest):
+def merge(src, dest, workers, keep_intermediates, explain, chunk_size, cluster):
     """Merge datasets using similarity matching"""
+    import tesci.clustering as clustering
+    import tesci.similarity as similarity
+    import tesci.streaming as streaming
+
     sources = src
     if sources is None or len(sources) == 0:
         raise click.UsageError("At least one source path must be specified")
+    # each of these runs a different kind of merge, none of them uses the others
+    modes = [
+        option
+        for option, value in (
+            ("--explain", explain),
+            ("--cluster", cluster),
+            ("--chunk-size", chunk_size is not None),
+            ("--keep-intermediates", keep_intermediates),
+        )
+        if value
+    ]
+    if len(modes) > 1:
+        raise click.UsageError(f"{' and '.join(modes)} cannot be used together")
     for src in sources:
         if not Path(src).exists():
             raise click.UsageError(f"Path {src} not found. Does the path specified exist on disk?")
 
     if dest is not None and not Path(dest).exists():
         raise click.UsageError(f"Path {dest} not found. Does the path specified exist on disk?")
-    similarity.merge(sources, dest)
+    if cluster:
+        clustering.merge(sources, dest, workers)
+        return
+    if chunk_size is not None:
+        streaming.merge(sources, dest, chunk_size, workers)
+        return
+    similarity.merge(sources, dest, workers, keep_intermediates, explain)
 
 
 @similarity_cli.command()
 def suggest():
     """Suggest transformations to apply to the dataset"""
+    import tesci.similarity as similarity
+
     similarity.suggest()
+
+
+@click.option(
+    "-s",
+    "--src",
+    type=str,
+    required=True,
+    help="Path to the data source",
+)
+@click.option(
+    "-d",
+    "--dest",
+    type=str,
+    default=None,
+    help="Path to the destination of the deduplicated data source",
+)
+@click.option(
+    "--stage",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Use the merge columns of this stage of a multi-stage merge",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes used to compare candidate rows and of threads used to search them (all cores with 1)",
+)
+@similarity_cli.command()
+def dedup(src, dest, stage, workers):
+    """Collapse near-duplicate rows of a data source"""
+    import tesci.similarity as similarity
+
+    if not Path(src).exists():
+        raise click.UsageError(f"Path {src} not found. Does the path specified exist on disk?")
+    if dest is not None and not Path(dest).exists():
+        raise click.UsageError(f"Path {dest} not found. Does the path specified exist on disk?")
+    similarity.dedup(src, dest, stage, workers)
+
+
+@click.option(
+    "-s",
+    "--src",
+    default=None,
+    multiple=True,
+    help="Path to the two data sources",
+)
+@click.option(
+    "-g",
+    "--gold",
+    type=str,
+    required=True,
+    help="Path to the true matches, one per row, by the reference values of both sources",
+)
+@click.option(
+    "--gold-columns",
+    type=str,
+    nargs=2,
+    default=None,
+    help="Columns of the gold file holding the reference values of the first and second source",
+)
+@click.option(
+    "--above",
+    type=str,
+    multiple=True,
+    help="Values of the above threshold of a column to try, as COLUMN=V1,V2,...",
+)
+@click.option(
+    "--cutoff",
+    type=str,
+    multiple=True,
+    help="Values of the cutoff threshold of a column to try, as COLUMN=V1,V2,...",
+)
+@click.option(
+    "--stage",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Use the merge columns of this stage of a multi-stage merge",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes used to preprocess the data sources and of threads used to search candidate rows (all cores with 1)",
+)
+@click.option(
+    "-d",
+    "--dest",
+    type=str,
+    default=None,
+    help="Path to the destination of the evaluation results",
+)
+@similarity_cli.command()
+def evaluate(src, gold, gold_columns, above, cutoff, stage, workers, dest):
+    """Evaluate merge thresholds against known matches, scoring candidate pairs once"""
+    import tesci.evaluation as evaluation
+
+    for path in list(src) + [gold]:
+        if not Path(path).exists():
+            raise click.UsageError(f"Path {path} not found. Does the path specified exist on disk?")
+    if dest is not None and not Path(dest).exists():
+        raise click.UsageError(f"Path {dest} not found. Does the path specified exist on disk?")
+    if len(src) != 2:
+        raise click.UsageError("Exactly two source paths must be specified")
+    evaluation.evaluate(
+        list(src), gold, list(above), list(cutoff), gold_columns, stage, workers, dest
+    )
+
+
+@similarity_cli.group(name="index")
+def index_cli():
+    """Manage the indexes of the sources merged into"""
+    pass
+
+
+@click.option(
+    "-s",
+    "--src",
+    type=str,
+    required=True,
+    help="Path to the data source merged into",
+)
+@click.option(
+    "--stage",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Use the merge columns of this stage of a multi-stage merge",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes used to preprocess the data source",
+)
+@index_cli.command()
+def build(src, stage, workers):
+    """Index a data source so merges into it skip preprocessing, deduplicating and normalizing it"""
+    import tesci.similarity as similarity
+
+    if not Path(src).exists():
+        raise click.UsageError(f"Path {src} not found. Does the path specified exist on disk?")
+    similarity.build_index(src, stage, workers)
@@ -1,29 +1,47 @@
+import importlib
+import logging
+
 import click
 
-from tesci.scripts.aggregate import aggregate
-from tesci.scripts.apply import apply
-from tesci.scripts.download import download
-from tesci.scripts.similarity import similarity_cli, merge, suggest
-from tesci.scripts.join import join
-from tesci.scripts.include import include
-from tesci.scripts.preview import preview
-from tesci.scripts.release import release
-from tesci.scripts.start import start
+
+class LazyGroup(click.Group):
+    """
+    Group importing the module of a subcommand only when the subcommand is looked up, so
+    starting the CLI does not import every command. Command modules import their heavy
+    dependencies (pandas, rapidfuzz, ...) inside the commands, listing the commands in
+    `--help` only imports click.
+    """
+
+    def __init__(self, *args, lazy_commands: dict[str, str] | None = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # command name to "module:attribute" of the command
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name in self.lazy_commands:
+            module_name, attribute = self.lazy_commands[cmd_name].split(":")
+            command = getattr(importlib.import_module(module_name), attribute)
+            self.add_command(command, cmd_name)
+            del self.lazy_commands[cmd_name]
+        return super().get_command(ctx, cmd_name)
 
 
-@click.group()
+@click.group(
+    cls=LazyGroup,
+    lazy_commands={
+        "aggregate": "tesci.scripts.aggregate:aggregate",
+        "apply": "tesci.scripts.apply:apply",
+        "download": "tesci.scripts.download:download",
+        "similarity": "tesci.scripts.similarity:similarity_cli",
+        "join": "tesci.scripts.join:join",
+        "include": "tesci.scripts.include:include",
+        "preview": "tesci.scripts.preview:preview",
+        "release": "tesci.scripts.release:release",
+        "start": "tesci.scripts.start:start",
+    },
+)
 def cli():
-    pass
-
-
-cli.add_command(aggregate)
-cli.add_command(apply)
-cli.add_command(download)
-cli.add_command(similarity_cli)
-similarity_cli.add_command(merge)
-similarity_cli.add_command(suggest)
-cli.add_command(join)
-cli.add_command(include)
-cli.add_command(preview)
-cli.add_command(release)
-cli.add_command(start)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
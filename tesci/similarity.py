@@ -1,13 +1,19 @@
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+import itertools
 import logging
+import tempfile
+import attrs
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from rapidfuzz import fuzz, process, utils
+from rapidfuzz import fuzz
 
+from tesci import candidates, column_profiles, columnstore, comparators, preprocessing
+from tesci.match_cache import MatchCache, row_hashes
+from tesci.reference_index import ReferenceIndex
 from tesci.scripts.context import Config, DataSource, JoinSource, Reader
-from tesci.types import FuzzyColumnCandidates, MatchesPerColumn
 
-logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +24,120 @@ class MergeState(Enum):
     NO_MATCH = 3
 
 
+ONE_TO_ONE_STRATEGIES = ["greedy", "mutual_best"]
+# pairs below this count are classified in-process, pool start-up would cost more
+MIN_PAIRS_PER_SHARD = 1000
+SHARDS_PER_WORKER = 4
+# format of the frames kept from intermediate stages of a multi-stage merge
+INTERMEDIATE_SUFFIX = ".parquet"
+
+
+@attrs.define
+class MatchResults:
+    """
+    Classified rows of a merge as parallel arrays. `side` is the source the row comes from
+    (2 for rows of df2 matched into df1, 1 for the remaining rows of df1), `df1_pos` and
+    `df2_pos` are the positional indexes of the pair (-1 when there is no candidate), `state`
+    holds MergeState values.
+    """
+
+    side: np.ndarray
+    df1_pos: np.ndarray
+    df2_pos: np.ndarray
+    score: np.ndarray
+    state: np.ndarray
+
+    @classmethod
+    def concat(cls, results: list["MatchResults"]) -> "MatchResults":
+        return cls(
+            *(
+                np.concatenate([getattr(result, field.name) for result in results])
+                for field in attrs.fields(cls)
+            )
+        )
+
+    def is_merged(self) -> np.ndarray:
+        return self.state <= MergeState.SUGGESTED.value
+
+    def take(self, indices: np.ndarray) -> "MatchResults":
+        return MatchResults(
+            *(getattr(self, field.name)[indices] for field in attrs.fields(MatchResults))
+        )
+
+
+@attrs.define
+class MergeSide:
+    """
+    One source of a merge: the frame, its normalized columns and the normalized reference
+    column used for the candidate search, optionally with block keys and a block index.
+    """
+
+    df: pd.DataFrame
+    normalized: candidates.NormalizedColumns
+    reference: list[str | None]
+    keys: list[tuple] | None = None
+    index: candidates.BlockIndex | None = None
+    shared: Path | None = None
+    hashes: np.ndarray | None = None
+    ngram: dict | None = None
+    ngram_index: candidates.NgramIndex | None = None
+    encoded: dict = attrs.field(factory=dict)
+
+    @classmethod
+    def create(
+        cls,
+        df: pd.DataFrame,
+        reference_column: str,
+        normalized: candidates.NormalizedColumns | None = None,
+    ) -> "MergeSide":
+        if normalized is None:
+            normalized = candidates.NormalizedColumns(df)
+        # a copy, since matched rows are removed from the candidate search
+        return cls(df, normalized, list(normalized.get(reference_column)))
+
+    def share(self, directory: Path, columns: list[str]) -> None:
+        """Writes the normalized columns to directory, where pool workers memory-map them."""
+        columnstore.write_columns(
+            directory, {column: self.normalized.get(column) for column in columns}
+        )
+        self.shared = Path(directory)
+
+    def subset(self, positions: np.ndarray) -> "MergeSide":
+        """The rows at positions, to search only those rows as candidates."""
+        keys = [self.keys[pos] for pos in positions] if self.keys is not None else None
+        index = candidates.BlockIndex(keys, self.index.windows) if self.index is not None else None
+        return MergeSide(
+            self.df.iloc[positions],
+            None,
+            [self.reference[pos] for pos in positions],
+            keys,
+            index,
+            ngram=self.ngram,
+        )
+
+    def get_ngram_index(self) -> candidates.NgramIndex:
+        """
+        N-gram index over the reference column, built on first use (after exclusions) unless
+        it was opened from the index of the source.
+        """
+        if self.ngram_index is None:
+            self.ngram_index = candidates.NgramIndex(
+                self.reference, n=self.ngram["n"], max_df=self.ngram["max_df"]
+            )
+        return self.ngram_index
+
+    def encode(self, column: str, comparator: comparators.Comparator):
+        """Values of a typed merge column encoded by its comparator, computed once."""
+        if column not in self.encoded:
+            self.encoded[column] = comparator.encode(self.df[column])
+        return self.encoded[column]
+
+    def exclude(self, positions: np.ndarray) -> None:
+        """Removes rows from the candidate search."""
+        for pos in positions:
+            self.reference[pos] = None
+
+
 def suggest():
     config = Config()
 
@@ -39,33 +159,12 @@ def suggest():
     df1 = data.join_sources.sources[0].df
     df2 = data.join_sources.sources[1].df
 
-    matches = MatchesPerColumn()
-    for col1 in df1.columns:
-        print("[df1] Processing column: ", col1)
-        for data1 in df1[col1][1:20]:
-            for col2 in df2.columns:
-                try:
-                    score = process.extractOne(
-                        data1,
-                        df2[col2],
-                        scorer=fuzz.QRatio,
-                        processor=utils.default_process,
-                    )
-                    if score[1] < 90:
-                        continue
-
-                    matches.column_candidates.setdefault(col1, []).append(
-                        FuzzyColumnCandidates(
-                            column=col2, reference_data=data1, fuzzy_matches=score
-                        )
-                    )
-                except TypeError:
-                    pass
+    matches = column_profiles.match_columns(df1, df2, score_cutoff=90)
     matched_columns = []
-    for col1, candidates in matches.column_candidates.items():
-        if len(candidates) == 0:
+    for col1, column_candidates in matches.column_candidates.items():
+        if len(column_candidates) == 0:
             continue
-        matched_columns.append((col1, candidates[0].column))
+        matched_columns.append((col1, column_candidates[0].column))
     print("Matched columns: ", matched_columns)
 
 
@@ -74,33 +173,458 @@ def safe_cast_to_str(df, col):
         df[col] = df[col].astype(str)
 
 
-def safe_replace(df, col, replace):
-    if col in df.columns:
-        df[col] = df[col].replace(replace)
+def _get_reference_column(columns):
+    return next(filter(lambda col: col.get("is_reference", False), columns), None)
 
 
-def safe_truncate(df, col, truncate_after):
-    if col in df.columns:
-        for truncate_str in truncate_after:
-            df[col] = df[col].str.split(truncate_str).str[0]
+def _preprocess_sources(columns, df1, df2, workers=1) -> None:
+    """
+    Casts the text merge columns to str and applies their preprocess options, in place. Either
+    frame can be None to only preprocess the other one.
+    """
+    preprocess_jobs = []
+    for column in columns:
+        from_col = column["from_"]
+        into_col = column["into_"]
+        similarity = column["similarity"]
+        if not similarity.get("preprocess"):
+           continue
+        # typed columns keep their dtype, missing values stay NA
+        if comparators.get_comparator(similarity) is None:
+            for df, col in ((df1, into_col), (df2, from_col), (df1, from_col), (df2, into_col)):
+                if df is not None:
+                    safe_cast_to_str(df, col)
+        if column.get("preprocess", None) is not None:
+            preprocessor = preprocessing.Preprocessor(column["preprocess"])
+            preprocess_jobs.extend(
+                (df, col, preprocessor)
+                for df, col in ((df1, into_col), (df2, from_col))
+                if df is not None and col in df.columns
+            )
+    preprocessing.apply_preprocessors(preprocess_jobs, workers)
 
 
-def _get_reference_column(columns):
-    return next(filter(lambda col: col.get("is_reference", False), columns), None)
+def _get_block_on(merge_config, columns) -> list[dict]:
+    """
+    Resolves the `block_on` entries of a merge config against its columns. An entry is either
+    a column name (from_ or into_) or a mapping with a `column` and optional `prefix` (first n
+    normalized characters) and `window` (sorted neighbourhood) keys.
+    """
+    block_on = []
+    for entry in merge_config.get("block_on", None) or []:
+        if isinstance(entry, str):
+            entry = {"column": entry}
+        column = _find_merge_column(entry["column"], columns, "block_on")
+        block_on.append(
+            {
+                "from_": column["from_"],
+                "into_": column["into_"],
+                "prefix": entry.get("prefix", None),
+                "window": entry.get("window", 0),
+            }
+        )
+    return block_on
+
+
+def _get_ngram_index(merge_config) -> dict | None:
+    """
+    Settings of the `ngram_index` merge option: n-gram length `n`, `shortlist` size and
+    `max_df`, the largest share of reference values an indexed n-gram may appear in.
+    """
+    ngram_index = merge_config.get("ngram_index", None)
+    if not ngram_index:
+        return None
+    if ngram_index is True:
+        ngram_index = {}
+    return {
+        "n": ngram_index.get("n", 3),
+        "shortlist": ngram_index.get("shortlist", 50),
+        "max_df": ngram_index.get("max_df", 0.1),
+    }
+
+
+def _find_merge_column(name, columns, option):
+    """Finds the merge column whose from_ or into_ equals name (case insensitive)."""
+    column = next((col for col in columns if name.lower() in (col["from_"], col["into_"])), None)
+    if column is None:
+        raise ValueError(f"Column \"{name}\" in '{option}' is not one of the merge columns.")
+    return column
+
+
+def _get_exact_keys(merge_config, columns) -> list[dict]:
+    """Resolves the `exact_keys` entries (identifier columns, e.g. DOI) of a merge config."""
+    return [
+        _find_merge_column(name, columns, "exact_keys")
+        for name in merge_config.get("exact_keys", None) or []
+    ]
+
+
+def _match_exact_keys(df1, df2, exact_keys) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs rows of df1 and df2 with equal identifiers. Keys are tried in order and each key
+    only pairs the rows left unmatched by the previous ones.
+
+    Returns the positional indexes of the paired df1 and df2 rows.
+    """
+    df1_pairs = []
+    df2_pairs = []
+    matched1 = np.zeros(len(df1), dtype=bool)
+    matched2 = np.zeros(len(df2), dtype=bool)
+    for column in exact_keys:
+        unmatched1 = np.flatnonzero(~matched1)
+        unmatched2 = np.flatnonzero(~matched2)
+        left, right = candidates.exact_key_pairs(
+            df1[column["into_"]].iloc[unmatched1], df2[column["from_"]].iloc[unmatched2]
+        )
+        df1_pairs.append(unmatched1[left])
+        df2_pairs.append(unmatched2[right])
+        matched1[unmatched1[left]] = True
+        matched2[unmatched2[right]] = True
+    if not exact_keys:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(df1_pairs), np.concatenate(df2_pairs)
+
+
+def _get_block_keys(df, block_on, side) -> list[tuple]:
+    key_columns = [
+        [candidates.block_key(value, entry["prefix"]) for value in df[entry[side]]]
+        for entry in block_on
+    ]
+    return list(zip(*key_columns))
+
+
+def _search_workers(workers: int) -> int:
+    """
+    Threads of the candidate search: every core for a merge in one process, otherwise as many
+    as the merge has pool processes, so the search does not oversubscribe the machine.
+    """
+    return -1 if workers <= 1 else workers
+
+
+def _search_candidates(query_side, positions, choice_side, workers=1):
+    """Best candidate of choice_side for the query_side rows at positions."""
+    queries = [query_side.reference[pos] for pos in positions]
+    if choice_side.ngram is not None:
+        rows, cols, scores = _search_ngram_index(query_side, positions, choice_side)
+        return candidates.best_of_pairs(len(queries), rows, cols, scores)
+    if choice_side.index is None:
+        return candidates.best_candidates(
+            queries, choice_side.reference, workers=_search_workers(workers)
+        )
+    return candidates.blocked_best_candidates(
+        queries,
+        choice_side.reference,
+        [query_side.keys[pos] for pos in positions],
+        choice_side.index,
+        workers=_search_workers(workers),
+    )
+
+
+def _search_ngram_index(query_side, positions, choice_side):
+    """Scored pairs of the query_side rows at positions and their n-gram shortlists."""
+    return candidates.indexed_candidates(
+        [query_side.reference[pos] for pos in positions],
+        choice_side.reference,
+        choice_side.get_ngram_index(),
+        shortlist=choice_side.ngram["shortlist"],
+        query_keys=[query_side.keys[pos] for pos in positions] if query_side.keys else None,
+        block_index=choice_side.index,
+    )
+
+
+def _search_candidates_cached(cache, direction, query_side, positions, choice_side, workers=1):
+    """
+    `_search_candidates` reusing the best candidates of a previous merge. A query that is
+    unchanged, and whose cached candidate is still one of the choices, is only scored against
+    the choices added since then. All other queries are searched in full. Not used with
+    n-gram shortlists or block windows, which depend on all the choices.
+    """
+    choice_positions = np.flatnonzero([value is not None for value in choice_side.reference])
+    choice_hashes = choice_side.hashes[choice_positions].tolist()
+    first_position = {}
+    for pos, choice in zip(choice_positions, choice_hashes):
+        first_position.setdefault(choice, pos)
+    query_hashes = query_side.hashes[positions].tolist()
+
+    best_idx = np.full(len(positions), -1, dtype=np.int64)
+    best_score = np.full(len(positions), np.nan)
+    hits = []
+    for i, query in enumerate(query_hashes):
+        entry = cache.best(direction, query)
+        if entry is None:
+            continue
+        candidate, score = entry
+        if candidate is None:
+            # there was no candidate, only new choices can add one
+            hits.append(i)
+        elif candidate in first_position:
+            best_idx[i] = first_position[candidate]
+            best_score[i] = score
+            hits.append(i)
+    hits = np.array(hits, dtype=np.int64)
+    misses = np.setdiff1d(np.arange(len(positions)), hits)
+
+    if len(misses) > 0:
+        best_idx[misses], best_score[misses] = _search_candidates(
+            query_side, positions[misses], choice_side, workers
+        )
+    previous = cache.choices(direction)
+    new_choices = np.array(
+        [pos for pos, choice in zip(choice_positions, choice_hashes) if choice not in previous],
+        dtype=np.int64,
+    )
+    if len(hits) > 0 and len(new_choices) > 0:
+        idx, score = _search_candidates(
+            query_side, positions[hits], choice_side.subset(new_choices), workers
+        )
+        new_idx = new_choices[np.maximum(idx, 0)]
+        # a missing cached score means there was no candidate, ties go to the lower position
+        # like in a full search
+        cached_score = best_score[hits]
+        better = (idx >= 0) & (
+            np.isnan(cached_score)
+            | (score > cached_score)
+            | ((score == cached_score) & (new_idx < best_idx[hits]))
+        )
+        best_idx[hits[better]] = new_idx[better]
+        best_score[hits[better]] = score[better]
+
+    cache.update_search(
+        direction,
+        query_hashes,
+        [int(choice_side.hashes[idx]) if idx >= 0 else None for idx in best_idx],
+        best_score,
+        choice_hashes,
+    )
+    return best_idx, best_score
+
+
+def _search_top_candidates(query_side, positions, choice_side, k, workers=1):
+    """Top k candidate pairs between the query_side rows at positions and choice_side."""
+    queries = [query_side.reference[pos] for pos in positions]
+    if choice_side.ngram is not None:
+        rows, cols, scores = candidates.top_of_pairs(
+            *_search_ngram_index(query_side, positions, choice_side), k
+        )
+    elif choice_side.index is None:
+        rows, cols, scores = candidates.top_candidates(
+            queries, choice_side.reference, k=k, workers=_search_workers(workers)
+        )
+    else:
+        rows, cols, scores = candidates.blocked_top_candidates(
+            queries,
+            choice_side.reference,
+            [query_side.keys[pos] for pos in positions],
+            choice_side.index,
+            k=k,
+            workers=_search_workers(workers),
+        )
+    return positions[rows], cols, scores
+
+
+def _match_directional(columns, side1, side2, key_matches, workers=1, cache=None) -> MatchResults:
+    """
+    Matches every row of df2 to its best df1 candidate, then every df1 row left unmerged to
+    its best df2 candidate. Several rows can be merged into the same row this way.
+    """
+    unmatched2 = np.setdiff1d(np.arange(len(side2.df)), key_matches.df2_pos)
+    if cache is not None:
+        best_idx, best_score = _search_candidates_cached(
+            cache, "df2", side2, unmatched2, side1, workers
+        )
+    else:
+        best_idx, best_score = _search_candidates(side2, unmatched2, side1, workers)
+    df2_matches = MatchResults(
+        side=np.full(len(unmatched2), 2, dtype=np.int8),
+        df1_pos=best_idx,
+        df2_pos=unmatched2,
+        score=best_score,
+        state=_classify_pairs(columns, side1, side2, best_idx, unmatched2, workers, cache),
+    )
+
+    print('[df2] Traversing columns: "', columns)
+    # rows of df1 that were already matched are skipped
+    matches = MatchResults.concat([key_matches, df2_matches])
+    unmatched1 = np.setdiff1d(np.arange(len(side1.df)), matches.df1_pos[matches.is_merged()])
+    if cache is not None:
+        best_idx, best_score = _search_candidates_cached(
+            cache, "df1", side1, unmatched1, side2, workers
+        )
+    else:
+        best_idx, best_score = _search_candidates(side1, unmatched1, side2, workers)
+    df1_matches = MatchResults(
+        side=np.full(len(unmatched1), 1, dtype=np.int8),
+        df1_pos=unmatched1,
+        df2_pos=best_idx,
+        score=best_score,
+        state=_classify_pairs(columns, side1, side2, unmatched1, best_idx, workers, cache),
+    )
+    return MatchResults.concat([matches, df1_matches])
+
+
+def _match_one_to_one(columns, side1, side2, key_matches, strategy, top_k, workers=1) -> MatchResults:
+    """
+    Scores the reference columns once, keeping the top_k candidates per row of either source,
+    and assigns every row to at most one row of the other source. Pairs are preferred by state,
+    then by reference score. With "greedy" the best remaining pair is taken until none is left,
+    with "mutual_best" a pair is taken only if each row is the other's best candidate.
+
+    Rows that are left unassigned come from both sources and keep their best candidate. If that
+    candidate would have been merged but was assigned elsewhere, the row is a POTENTIAL match.
+    """
+    unmatched2 = np.setdiff1d(np.arange(len(side2.df)), key_matches.df2_pos)
+    pair_pos2, pair_pos1, pair_score = _search_top_candidates(
+        side2, unmatched2, side1, top_k, workers
+    )
+    pair_state = _classify_pairs(columns, side1, side2, pair_pos1, pair_pos2, workers)
+    # best pairs first: lowest state, highest score, then by position
+    order = np.lexsort((pair_pos1, pair_pos2, -pair_score, pair_state))
+    pair_pos1, pair_pos2 = pair_pos1[order], pair_pos2[order]
+    pair_score, pair_state = pair_score[order], pair_state[order]
+    mergeable = pair_state <= MergeState.SUGGESTED.value
+
+    assigned1 = np.zeros(len(side1.df), dtype=bool)
+    assigned2 = np.zeros(len(side2.df), dtype=bool)
+    assigned1[key_matches.df1_pos] = True
+    assigned2[key_matches.df2_pos] = True
+    if strategy == "greedy":
+        taken = np.zeros(len(pair_pos1), dtype=bool)
+        for i in np.flatnonzero(mergeable):
+            if not assigned1[pair_pos1[i]] and not assigned2[pair_pos2[i]]:
+                assigned1[pair_pos1[i]] = assigned2[pair_pos2[i]] = True
+                taken[i] = True
+    else:
+        # pairs are sorted best first, so the first pair of a row is its best
+        _, best_of2 = np.unique(pair_pos2, return_index=True)
+        _, best_of1 = np.unique(pair_pos1, return_index=True)
+        taken = np.zeros(len(pair_pos1), dtype=bool)
+        taken[np.intersect1d(best_of1, best_of2)] = True
+        taken &= mergeable
+        assigned1[pair_pos1[taken]] = True
+        assigned2[pair_pos2[taken]] = True
+
+    assigned = MatchResults(
+        side=np.full(taken.sum(), 2, dtype=np.int8),
+        df1_pos=pair_pos1[taken],
+        df2_pos=pair_pos2[taken],
+        score=pair_score[taken],
+        state=pair_state[taken],
+    )
+    assigned = assigned.take(np.argsort(assigned.df2_pos, kind="stable"))
+
+    unassigned = []
+    for side, positions, other in ((2, pair_pos2, pair_pos1), (1, pair_pos1, pair_pos2)):
+        rows = np.flatnonzero(~(assigned2 if side == 2 else assigned1))
+        _, best = np.unique(positions, return_index=True)
+        best_pair = np.full(len(assigned2 if side == 2 else assigned1), -1, dtype=np.int64)
+        best_pair[positions[best]] = best
+        pairs = best_pair[rows]
+        found = pairs >= 0
+        state = np.full(len(rows), MergeState.NO_MATCH.value, dtype=np.int8)
+        state[found] = np.maximum(pair_state[pairs[found]], MergeState.POTENTIAL.value)
+        other_pos = np.full(len(rows), -1, dtype=np.int64)
+        other_pos[found] = other[pairs[found]]
+        score = np.full(len(rows), np.nan)
+        score[found] = pair_score[pairs[found]]
+        unassigned.append(
+            MatchResults(
+                side=np.full(len(rows), side, dtype=np.int8),
+                df1_pos=rows if side == 1 else other_pos,
+                df2_pos=rows if side == 2 else other_pos,
+                score=score,
+                state=state,
+            )
+        )
+    return MatchResults.concat([key_matches, assigned, *unassigned])
+
+
+def _classify_pairs(columns, side1, side2, df1_pos, df2_pos, workers=1, cache=None) -> np.ndarray:
+    """
+    MergeState values of candidate pairs, pairs without a candidate (-1) are NO_MATCH. With
+    several workers the pairs are split into shards that are classified in a process pool
+    against the memory-mapped normalized columns of both sides, see `MergeSide.share`. With
+    a cache, only pairs that it does not know yet are classified.
+    """
+    if cache is not None:
+        states = np.full(len(df1_pos), MergeState.NO_MATCH.value, dtype=np.int8)
+        found = (df1_pos >= 0) & (df2_pos >= 0)
+        df1_rows = side1.hashes[df1_pos[found]].tolist()
+        df2_rows = side2.hashes[df2_pos[found]].tolist()
+        cached = np.array(
+            [cache.state(df1_row, df2_row) for df1_row, df2_row in zip(df1_rows, df2_rows)],
+            dtype=object,
+        )
+        known = np.array([state is not None for state in cached], dtype=bool)
+        found_states = np.empty(len(cached), dtype=np.int8)
+        found_states[known] = cached[known].astype(np.int8)
+        found_states[~known] = _classify_pairs(
+            columns,
+            side1,
+            side2,
+            df1_pos[found][~known],
+            df2_pos[found][~known],
+            workers,
+        )
+        states[found] = found_states
+        cache.update_states(df1_rows, df2_rows, found_states.tolist())
+        return states
+
+    plan = VerificationPlan(columns)
+    if plan.typed_steps:
+        states = np.full(len(df1_pos), MergeState.NO_MATCH.value, dtype=np.int8)
+        found = np.flatnonzero((df1_pos >= 0) & (df2_pos >= 0))
+        states[found] = plan.classify_typed(side1, side2, df1_pos[found], df2_pos[found])
+        if plan.steps:
+            undecided = found[states[found] != MergeState.NO_MATCH.value]
+            text_states = _classify_text(
+                columns, side1, side2, df1_pos[undecided], df2_pos[undecided], workers
+            )
+            states[undecided] = np.maximum(states[undecided], text_states)
+        return states
+    return _classify_text(columns, side1, side2, df1_pos, df2_pos, workers)
 
 
-def _preprocess_data(df1, df2, from_col, into_col, preprocess_config):
-    remove = preprocess_config.get("remove", None)
-    replace = preprocess_config.get("replace", None)
-    truncate_after = preprocess_config.get("truncate_after", None)
-    if remove is not None:
-        pass
-    if replace is not None:
-        for df, col in ((df1, into_col), (df2, from_col), (df1, from_col), (df2, into_col)):
-            safe_replace(df, col, replace)
-    if truncate_after is not None:
-        for df, col in ((df1, into_col), (df2, from_col), (df1, from_col), (df2, into_col)):
-            safe_truncate(df, col, truncate_after)
+def _classify_text(columns, side1, side2, df1_pos, df2_pos, workers=1) -> np.ndarray:
+    """MergeState values of candidate pairs on the text columns, see `_classify_pairs`."""
+    if workers <= 1 or side1.shared is None or len(df1_pos) < MIN_PAIRS_PER_SHARD:
+        return _classify_shard(columns, side1.normalized, side2.normalized, df1_pos, df2_pos)
+
+    shards = np.array_split(np.arange(len(df1_pos)), workers * SHARDS_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        states = executor.map(
+            _classify_mapped_shard,
+            itertools.repeat(columns),
+            itertools.repeat(side1.shared),
+            itertools.repeat(side2.shared),
+            [df1_pos[shard] for shard in shards],
+            [df2_pos[shard] for shard in shards],
+        )
+        # map keeps the order of the shards, so results do not depend on the number of workers
+        return np.concatenate(list(states))
+
+
+def _classify_shard(columns, normalized1, normalized2, df1_pos, df2_pos) -> np.ndarray:
+    plan = VerificationPlan(columns)
+    return np.array(
+        [
+            plan.classify(normalized2, pos2, normalized1, pos1).value
+            if pos1 >= 0 and pos2 >= 0
+            else MergeState.NO_MATCH.value
+            for pos1, pos2 in zip(df1_pos, df2_pos)
+        ],
+        dtype=np.int8,
+    )
+
+
+def _classify_mapped_shard(columns, directory1, directory2, df1_pos, df2_pos) -> np.ndarray:
+    """Entry point of pool workers, reads the normalized columns shared by `MergeSide.share`."""
+    return _classify_shard(
+        columns,
+        columnstore.MappedColumns(directory1),
+        columnstore.MappedColumns(directory2),
+        df1_pos,
+        df2_pos,
+    )
 
 
 def assert_no_duplicate_columns(from_columns, into_columns):
@@ -119,7 +643,13 @@ def assert_no_duplicate_columns(from_columns, into_columns):
         raise ValueError(err_msg)
 
 
-def merge(sources: list[Path] | None, dest: Path | None):
+def merge(
+    sources: list[Path] | None,
+    dest: Path | None,
+    workers: int = 1,
+    keep_intermediates: bool = False,
+    explain: bool = False,
+):
     config = Config()
     if "similarity_config" not in config.content.get("join", {}).keys():
         logging.info(
@@ -134,256 +664,495 @@ def merge(sources: list[Path] | None, dest: Path | None):
     if config.content.get("join", {}).get("multi_stage", False) and len(sources) == 2:
         raise ValueError("Two sources provided. Please set multi_stage join to False in the config file and remove stage_ prefixes.")
 
+    path_override = Path(dest) if dest is not None else None
+    max_stage_num = _get_multi_stage_nums(config)
 
-    first_src = sources[0]
-    second_src = sources[1]
+    if explain:
+        for stage in [None] if max_stage_num == 1 else range(1, max_stage_num + 1):
+            print("\n".join(explain_stage(config, stage)))
+        return
 
-    max_stage_num = _get_multi_stage_nums(config)
+    if max_stage_num == 1:
+        output = _merge_two_sources(
+            _load_source(sources[0]),
+            _load_source(sources[1]),
+            config,
+            stage=None,
+            workers=workers,
+            df1_src=sources[0],
+        )
+        _save_output(output, path_override)
+        return
 
-    if max_stage_num != 1:
-        for i in range(0, max_stage_num):
-            if i+1 != max_stage_num:
-                name_override = f"config-stage_{i+1}_merged.xls"
-            if i != 0:
-                first_src = sources[i+1]
-                second_src = DataSource.get_file_path(Config(), name_override=name_override)
-            _merge_two_sources(first_src, second_src, config, stage=i+1, save_to_disk_name_override=name_override, dest=dest)
-            if i+1 == max_stage_num:
-                name_override = "config-final.xls"
-    else:
-        _merge_two_sources(first_src, second_src, config, save_to_disk_name_override=None, dest=dest)         
+    # stages are chained in memory, the merged frame of a stage is the second source of the next
+    output = None
+    for stage in range(1, max_stage_num + 1):
+        if stage == 1:
+            df1, df2, df2_normalized = _load_source(sources[0]), _load_source(sources[1]), None
+        else:
+            df1, df2, df2_normalized = _load_source(sources[stage]), output.final, output.normalized
+        output = _merge_two_sources(
+            df1,
+            df2,
+            config,
+            stage=stage,
+            workers=workers,
+            df2_normalized=df2_normalized,
+            df1_src=sources[0] if stage == 1 else sources[stage],
+        )
+        if stage == max_stage_num:
+            _save_output(output, path_override)
+        elif keep_intermediates:
+            _save_output(
+                output,
+                path_override,
+                prefix=f"config-stage_{stage}",
+                suffix=INTERMEDIATE_SUFFIX,
+            )
 
 
-def _merge_two_sources(first_src: Path, second_src: Path, config: Config, stage: int | None, save_to_disk_name_override: str | None, dest: Path | None):
-    if stage is not None:
-        stage_config = config.content["join"]["similarity_config"]["merge"][f"stage_{stage}"]
-        columns = stage_config["columns"]
+def dedup(src: Path, dest: Path | None, stage: int | None = None, workers: int = 1) -> None:
+    """
+    Collapses the near-duplicate rows of a source, using the merge columns of the merge config
+    (or of a stage) on the side whose column names the source has.
+    """
+    config = Config()
+    if "similarity_config" not in config.content.get("join", {}).keys():
+        logging.info(
+            "No similarity_config to apply to the dataset. Are you using a config file that has similarity_config?"
+        )
+        return
+    merge_config = _get_merge_config(config, stage)
+    columns = merge_config["columns"]
+    for column in columns:
+        column["from_"] = column["from_"].lower()
+        column["into_"] = column["into_"].lower()
+
+    df = _load_source(src)
+    df.rename(columns=str.lower, inplace=True)
+    side = next(
+        (
+            side
+            for side in ("into_", "from_")
+            if all(column[side] in df.columns for column in columns)
+        ),
+        None,
+    )
+    if side is None:
+        raise ValueError(f"Source {src} has neither all into_ nor all from_ merge columns.")
+    if side == "into_":
+        _preprocess_sources(columns, df, None, workers)
     else:
-        columns = config.content["join"]["similarity_config"]["merge"]["columns"]
+        _preprocess_sources(columns, None, df, workers)
+    deduplicated = deduplicate(df, columns, side, merge_config, workers)
+    print(f"Removed {len(df) - len(deduplicated)} duplicates of {len(df)} rows")
+    DataSource.save_to_file(
+        deduplicated,
+        config,
+        name_override=f"{Path(src).stem}-dedup{Path(src).suffix}",
+        path_override=Path(dest) if dest is not None else None,
+    )
 
-    from_columns = [col["from_"].lower() for col in columns]
-    into_columns = [col["into_"].lower() for col in columns]
-    assert_no_duplicate_columns(from_columns, into_columns)
 
-    if first_src is not None and second_src is not None:
-        first_src = Path(first_src)
-        second_src = Path(second_src)
-        df1 = JoinSource(Reader(first_src).load(), None).df
-        df2 = JoinSource(Reader(second_src).load(), None).df
-    else:
-        # FIXME: when src is specified through config
-        data = DataSource.get()
-        df1 = data.join_sources.sources[0].df
-        df2 = data.join_sources.sources[1].df
+def deduplicate(df, columns, side, merge_config, workers=1) -> pd.DataFrame:
+    """
+    Collapses near-duplicate rows of a preprocessed frame, side ("into_" or "from_") names
+    the frame's merge columns. Candidate pairs come from a self-join over the reference
+    column, with the `block_on` and `ngram_index` options of merge_config. Pairs classified
+    as exact or suggested matches are duplicates, and duplicates of duplicates are grouped
+    together. Every group keeps its first row, with missing values filled from the others.
+    """
+    groups = _duplicate_groups(df, columns, side, merge_config, workers)
+    return _collapse_duplicates(df, groups) if groups is not None else df
 
-    df1.rename(columns=str.lower, inplace=True)
-    df2.rename(columns=str.lower, inplace=True)
 
+def _duplicate_groups(df, columns, side, merge_config, workers=1) -> np.ndarray | None:
+    """Group (position of the first row) of every row of df, see `deduplicate`. None without duplicates."""
+    side_columns = [dict(column, from_=column[side], into_=column[side]) for column in columns]
+    reference_column = _get_reference_column(side_columns)
+    merge_side = MergeSide.create(df, reference_column["into_"])
+    merge_side.ngram = _get_ngram_index(merge_config)
+    block_on = _get_block_on(merge_config, columns)
+    if block_on:
+        merge_side.keys = _get_block_keys(df, block_on, side)
+        merge_side.index = candidates.BlockIndex(merge_side.keys, [entry["window"] for entry in block_on])
+
+    # every row finds itself as well, hence one more candidate
+    rows, cols, scores = _search_top_candidates(
+        merge_side, np.arange(len(df)), merge_side, merge_config.get("top_k", 5) + 1, workers
+    )
+    pairs = (rows < cols) & (scores >= 0)
+    rows, cols = rows[pairs], cols[pairs]
+    with tempfile.TemporaryDirectory(prefix="tesci-") as shared_dir:
+        if workers > 1:
+            merge_side.share(Path(shared_dir), [column["into_"] for column in side_columns])
+        states = _classify_pairs(side_columns, merge_side, merge_side, rows, cols, workers)
+    duplicates = states <= MergeState.SUGGESTED.value
+    if not duplicates.any():
+        return None
+
+    groups = candidates.UnionFind(len(df))
+    for row, col in zip(rows[duplicates].tolist(), cols[duplicates].tolist()):
+        groups.union(row, col)
+    # the root of a group is its first row
+    return groups.roots()
+
+
+def _collapse_duplicates(df, groups) -> pd.DataFrame:
+    """Keeps the first row of every group, with missing values filled from the others."""
+    deduplicated = df.groupby(groups, sort=True).first()
+    deduplicated.index = df.index[np.unique(groups)]
+    return deduplicated
+
+
+def _prepared_columns(columns, df) -> list[str]:
+    """Columns of df, the first source of a merge, whose values `_preprocess_sources` changes."""
+    prepared = []
+    for column in columns:
+        similarity = column["similarity"]
+        if not similarity.get("preprocess"):
+            continue
+        if comparators.get_comparator(similarity) is None:
+            prepared.extend((column["into_"], column["from_"]))
+        elif column.get("preprocess", None) is not None:
+            prepared.append(column["into_"])
+    return [col for col in dict.fromkeys(prepared) if col in df.columns]
+
+
+def build_index(src: Path, stage: int | None = None, workers: int = 1) -> None:
+    """
+    Builds the index of a source merged into as the first source of a merge (or of a stage),
+    see `ReferenceIndex`. Merges use the index of their first source once it exists, and
+    rebuild it when the source or the merge settings change.
+    """
+    config = Config()
+    if "similarity_config" not in config.content.get("join", {}).keys():
+        logging.info(
+            "No similarity_config to apply to the dataset. Are you using a config file that has similarity_config?"
+        )
+        return
+    merge_config = _get_merge_config(config, stage)
+    columns = merge_config["columns"]
     for column in columns:
         column["from_"] = column["from_"].lower()
         column["into_"] = column["into_"].lower()
 
+    # the index only holds the merge columns, the from_ columns are cast to str if present
+    load_columns = _merge_source_columns(config, merge_config, "into_")
+    if load_columns is not None:
+        load_columns += [column["from_"] for column in columns]
+    df = _load_source(src, load_columns)
+    df.rename(columns=str.lower, inplace=True)
     if config.content["join"]["similarity_config"]["merge"].get("drop_duplicates"):
-        df1.drop_duplicates(inplace=True)
-        df2.drop_duplicates(inplace=True)
+        df.drop_duplicates(inplace=True)
+    _preprocess_sources(columns, df, None, workers)
+    groups = None
+    if merge_config.get("dedup"):
+        groups = _duplicate_groups(df, columns, "into_", merge_config, workers)
+    index = ReferenceIndex(src)
+    _build_index(index, df, groups, config, merge_config)
+    print(f"Indexed {len(df)} rows of {src} in {index.directory}")
 
-    for column in columns:
-        from_col = column["from_"]
-        into_col = column["into_"]
-        similarity = column["similarity"]
-        if not similarity.get("preprocess"):
-           continue
-        for df, col in ((df1, into_col), (df2, from_col), (df1, from_col), (df2, into_col)):
-            safe_cast_to_str(df, col)
-        if column.get("preprocess", None) is not None:
-            preprocess_config = column["preprocess"]
-            _preprocess_data(df1, df2, from_col, into_col, preprocess_config)
 
-    # TODO: validate if columns are present in df1 and df2
-    # TODO: auto-determine if column can be nullable, this useful for DOI or Year columns where 100% match is expected
-    exact_matches = []
-    suggested_matches = []
-    potential_matches = []
-    no_matches = []
-    merged_exact_series = []
-    merged_suggested_series = []
-    common_cols = df1.columns.intersection(df2.columns).tolist()
-    print('[df1] Traversing columns: "', columns)
+def _build_index(index: ReferenceIndex, df1, groups, config, merge_config) -> None:
+    """Indexes df1, the preprocessed first source before collapsing its duplicate groups."""
+    columns = merge_config["columns"]
+    index.build(
+        _collapse_duplicates(df1, groups) if groups is not None else df1,
+        df1[_prepared_columns(columns, df1)],
+        [column["into_"] for column in columns],
+        _get_reference_column(columns)["into_"],
+        _index_settings(config, merge_config),
+        _get_ngram_index(merge_config),
+        groups,
+    )
+
+
+def _index_settings(config, merge_config) -> dict:
+    """Merge settings the index of the first source depends on."""
+    return {
+        "columns": [
+            {key: column.get(key) for key in ("into_", "from_", "similarity", "preprocess")}
+            for column in merge_config["columns"]
+        ],
+        "drop_duplicates": config.content["join"]["similarity_config"]["merge"].get(
+            "drop_duplicates"
+        ),
+        "dedup": merge_config.get("dedup"),
+        "dedup_options": {
+            key: merge_config.get(key) for key in ("top_k", "block_on", "ngram_index")
+        }
+        if merge_config.get("dedup")
+        else None,
+        "ngram_index": _get_ngram_index(merge_config),
+    }
+
+
+def _get_merge_config(config: Config, stage: int | None) -> dict:
+    if stage is not None:
+        return config.content["join"]["similarity_config"]["merge"][f"stage_{stage}"]
+    return config.content["join"]["similarity_config"]["merge"]
+
+
+def explain_stage(config: Config, stage: int | None) -> list[str]:
+    """Describes how a merge stage finds candidate pairs and verifies them, without merging."""
+    merge_config = _get_merge_config(config, stage)
+    # merge columns are looked up by their lowercased names, like in `_merge_two_sources`
+    columns = [
+        dict(column, from_=column["from_"].lower(), into_=column["into_"].lower())
+        for column in merge_config["columns"]
+    ]
     reference_column = _get_reference_column(columns)
-    for _, data2 in df2.iterrows():
-        row_states = []  # [exact, suggested, potential, no]
-        score = process.extractOne(
-            data2[reference_column["from_"]],
-            df1[reference_column["into_"]],
-            scorer=fuzz.QRatio,
-            processor=utils.default_process,
-        )
-        s2 = df1.iloc[score[2]].copy()
-        for column in columns:
-            from_col = column["from_"]
-            into_col = column["into_"]
-            similarity_above = column["similarity"]["above"]
-            similarity_cutoff = column["similarity"]["cutoff"]
-            if (
-                pd.isna(data2[from_col])
-                or data2[from_col] == "nan"
-                or pd.isna(s2[into_col])
-                or s2[into_col] == "nan"
-            ):
-                continue
+    lines = ["Merge" if stage is None else f"Stage {stage}", "  candidates:"]
+    exact_keys = _get_exact_keys(merge_config, columns)
+    if exact_keys:
+        keys = ", ".join(f'{column["from_"]} -> {column["into_"]}' for column in exact_keys)
+        lines.append(f"    exact keys: {keys}")
+    for entry in _get_block_on(merge_config, columns):
+        prefix = f', prefix {entry["prefix"]}' if entry["prefix"] else ""
+        window = f', window {entry["window"]}' if entry["window"] else ""
+        lines.append(f'    block on: {entry["from_"]} -> {entry["into_"]}{prefix}{window}')
+    search = f'    search: QRatio on {reference_column["from_"]} -> {reference_column["into_"]}'
+    ngram_index = _get_ngram_index(merge_config)
+    if ngram_index is not None:
+        search += " (n-gram index, n {n}, shortlist {shortlist}, max_df {max_df})".format(
+            **ngram_index
+        )
+    lines.append(search)
+    one_to_one = merge_config.get("one_to_one", None)
+    if one_to_one is not None:
+        lines.append(f'    one to one: {one_to_one}, top {merge_config.get("top_k", 5)}')
+    lines.append("  verification:")
+    lines.extend(f"    {line}" for line in VerificationPlan(columns).explain())
+    return lines
 
-            ratio = fuzz.QRatio(
-                data2[from_col], s2[into_col], processor=utils.default_process
-            )
-            if ratio == 100:
-                row_states.append(MergeState.EXACT)
-                continue
-            if ratio >= similarity_above:
-                row_states.append(MergeState.SUGGESTED)
-                continue
-            if ratio >= similarity_cutoff:
-                row_states.append(MergeState.POTENTIAL)
-                continue
-            row_states.append(MergeState.NO_MATCH)
 
-        try:
-            s1 = data2
-            if MergeState.NO_MATCH in row_states:
-                no_matches.append((data2, score))
-                continue
-            if MergeState.POTENTIAL in row_states:
-                potential_matches.append((data2, score))
-                continue
+@attrs.define
+class MergeOutput:
+    """Frames produced by a merge, and the normalized columns of the final frame."""
 
-            if MergeState.SUGGESTED in row_states:
-                suggested_matches.append((data2, score))
-                res = pd.concat([s1, s2], join="inner").groupby(level=0).last()
-                merged_suggested_series.append(res)
-                continue
+    matches: dict[str, pd.DataFrame]
+    final: pd.DataFrame
+    normalized: candidates.NormalizedColumns
 
-            exact_matches.append((data2, score))
-            res = pd.concat([s1, s2], join="inner").groupby(level=0).last()
-            merged_exact_series.append(res)
 
-        except TypeError:
-            continue
+def _load_source(src: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    """Frame of a source, only of columns (case insensitive) if given."""
+    return JoinSource(Reader(Path(src)).load(columns), None).df
+
+
+def _merge_source_columns(config, merge_config, side) -> list[str] | None:
+    """
+    Columns of a source needed to match it, the merge columns of side ("into_" or "from_").
+    None when `drop_duplicates` compares whole rows, so every column is needed.
+    """
+    if config.content["join"]["similarity_config"]["merge"].get("drop_duplicates"):
+        return None
+    return [column[side] for column in merge_config["columns"]]
 
-    print('[df2] Traversing columns: "', columns)
-    sorted_exact_matches = sorted(exact_matches, key=lambda x: x[1][2])
-    sorted_suggested_matches = sorted(suggested_matches, key=lambda x: x[1][2])
 
-    keys_to_match = {
-        t2[2]: (t1, t2)
-        for t1, t2 in (
-            sorted_exact_matches
-            + sorted_suggested_matches
-            # + sorted_potential_matches
-            # + sorted_no_matches
+def _save_output(
+    output: MergeOutput, path_override: Path | None, prefix: str = "config", suffix: str = ".xls"
+) -> None:
+    """
+    Saves the match frames to path_override (or the config home) and the final frame to the
+    config home. Intermediate stages use a stage prefix and a columnar format.
+    """
+    for name, df in output.matches.items():
+        DataSource.save_to_file(
+            df,
+            Config(),
+            name_override=f"{prefix}-{name}-matches{suffix}",
+            path_override=path_override,
         )
-    }
-    skipped = 0
-    for idx, data1 in df1.iterrows():
-        if idx in keys_to_match.keys():
-            skipped += 1
-            # already matched
-            continue
-        row_states = []  # [exact, suggested, potential, no]
-        score = process.extractOne(
-            data1[reference_column["into_"]],
-            df2[reference_column["from_"]],
-            scorer=fuzz.QRatio,
-            processor=utils.default_process,
-        )
-        s2 = df2.iloc[score[2]].copy()
-        for column in columns:
-            from_col = column["from_"]
-            into_col = column["into_"]
-            similarity_above = column["similarity"]["above"]
-            similarity_cutoff = column["similarity"]["cutoff"]
-            if (
-                pd.isna(data1[into_col])
-                or data1[into_col] == "nan"
-                or pd.isna(s2[from_col])
-                or s2[from_col] == "nan"
-            ):
-                continue
+    final_name = "config-final.xls" if prefix == "config" else f"{prefix}_merged{suffix}"
+    DataSource.save_to_file(output.final, Config(), name_override=final_name)
 
-            ratio = fuzz.QRatio(
-                data1[into_col], s2[from_col], processor=utils.default_process
-            )
-            if ratio == 100:
-                row_states.append(MergeState.EXACT)
-                continue
-            if ratio >= similarity_above:
-                row_states.append(MergeState.SUGGESTED)
-                continue
-            if ratio >= similarity_cutoff:
-                row_states.append(MergeState.POTENTIAL)
-                continue
-            row_states.append(MergeState.NO_MATCH)
 
-        try:
-            s1 = data1
+def _merge_two_sources(
+    df1: pd.DataFrame,
+    df2: pd.DataFrame,
+    config: Config,
+    stage: int | None,
+    workers: int = 1,
+    df2_normalized: candidates.NormalizedColumns | None = None,
+    df1_src: Path | None = None,
+) -> MergeOutput:
+    """
+    Merges df2 into df1. df2_normalized holds normalized columns of df2 computed by a
+    previous stage, columns whose values change in this stage's preprocessing are recomputed.
+    df1_src is the file df1 was loaded from, whose index is used if it was built: a current
+    index gives df1 preprocessed, deduplicated and normalized, a stale one is rebuilt.
+    """
+    merge_config = _get_merge_config(config, stage)
+    columns = merge_config["columns"]
 
-            if MergeState.NO_MATCH in row_states:
-                no_matches.append((data1, score))
-                continue
-            if MergeState.POTENTIAL in row_states:
-                potential_matches.append((data1, score))
-                continue
+    from_columns = [col["from_"].lower() for col in columns]
+    into_columns = [col["into_"].lower() for col in columns]
+    assert_no_duplicate_columns(from_columns, into_columns)
 
-            if MergeState.SUGGESTED in row_states:
-                suggested_matches.append((data1, score))
-                res = pd.concat([s1, s2], join="inner").groupby(level=0).last()
-                merged_suggested_series.append(res)
-                continue
+    df1.rename(columns=str.lower, inplace=True)
+    df2.rename(columns=str.lower, inplace=True)
 
-            exact_matches.append((data1, score))
-            res = pd.concat([s1, s2], join="inner").groupby(level=0).last()
-            merged_exact_series.append(res)
+    for column in columns:
+        column["from_"] = column["from_"].lower()
+        column["into_"] = column["into_"].lower()
 
-        except TypeError:
-            continue
-        pass
+    if config.content["join"]["similarity_config"]["merge"].get("drop_duplicates"):
+        df1.drop_duplicates(inplace=True)
+        df2.drop_duplicates(inplace=True)
 
-    merged_exact_df = pd.DataFrame(merged_exact_series)
-    merged_suggested_df = pd.DataFrame(merged_suggested_series)
-    merged_df = pd.concat([merged_exact_df, merged_suggested_df])
+    # values before preprocessing, to tell which cached columns are still valid
+    cached_columns = {}
+    if df2_normalized is not None:
+        cached_columns = {
+            col: df2[col] for col in df2_normalized.cached().keys() if col in df2.columns
+        }
 
-    exact_matches_series = [t[0] for t in exact_matches]
-    suggested_matches_series = [t[0] for t in suggested_matches]
-    potential_matches_series = [t[0] for t in potential_matches]
-    no_matches_series = [t[0] for t in no_matches]
-    for column in columns:
-        from_col = column["from_"]
-        into_col = column["into_"]
-        for row in (
-            exact_matches_series
-            + suggested_matches_series
-            + potential_matches_series
-            + no_matches_series
-        ):
-            row.rename({from_col: into_col}, inplace=True)
-
-    exact_matches_df = pd.DataFrame(exact_matches_series)
-    suggested_matches_df = pd.DataFrame(suggested_matches_series)
-    potential_matches_df = pd.DataFrame(potential_matches_series)
-    no_matches_df = pd.DataFrame(no_matches_series)
-    no_matches_df = pd.concat([no_matches_df, potential_matches_df])
-    final_df = pd.concat(
-        [exact_matches_df, suggested_matches_df, potential_matches_df, no_matches_df]
+    df1_index = ReferenceIndex(df1_src) if df1_src is not None else None
+    if df1_index is not None and not df1_index.exists():
+        df1_index = None
+    df1_prepared = df1_index is not None and df1_index.is_current(
+        _index_settings(config, merge_config), df1.index
     )
+    df1_groups = None
+    if df1_prepared:
+        df1, df1_groups = df1_index.prepare(df1)
+    _preprocess_sources(columns, None if df1_prepared else df1, df2, workers)
+    if merge_config.get("dedup"):
+        if not df1_prepared:
+            df1_groups = _duplicate_groups(df1, columns, "into_", merge_config, workers)
+        df2 = deduplicate(df2, columns, "from_", merge_config, workers)
+    if df1_index is not None and not df1_prepared:
+        print(f"[df1] Rebuilding the index of {df1_src}")
+        _build_index(df1_index, df1, df1_groups, config, merge_config)
+    if df1_groups is not None:
+        df1 = _collapse_duplicates(df1, df1_groups)
+
+    if df2_normalized is not None:
+        # rows left after dropping duplicates keep their label, which is their position in the cache
+        positions = df2.index.to_numpy()
+        df2_normalized = candidates.NormalizedColumns(
+            df2,
+            {
+                col: [df2_normalized.cached()[col][pos] for pos in positions]
+                for col, values in cached_columns.items()
+                if values is df2[col] or values.loc[df2.index].equals(df2[col])
+            },
+        )
+
+    # TODO: validate if columns are present in df1 and df2
+    # TODO: auto-determine if column can be nullable, this useful for DOI or Year columns where 100% match is expected
+    print('[df1] Traversing columns: "', columns)
+    reference_column = _get_reference_column(columns)
+    if comparators.get_comparator(reference_column["similarity"]) is not None:
+        raise ValueError("The reference column is searched by text similarity and cannot have a type.")
+    df1_normalized, df1_ngram_index = None, None
+    if df1_index is not None:
+        df1_normalized, df1_ngram_index = df1_index.open(df1)
+    side1 = MergeSide.create(df1, reference_column["into_"], df1_normalized)
+    side2 = MergeSide.create(df2, reference_column["from_"], df2_normalized)
+    side1.ngram = side2.ngram = _get_ngram_index(merge_config)
+    side1.ngram_index = df1_ngram_index
+    block_on = _get_block_on(merge_config, columns)
+    if block_on:
+        windows = [entry["window"] for entry in block_on]
+        for side, name in ((side1, "into_"), (side2, "from_")):
+            side.keys = _get_block_keys(side.df, block_on, name)
+            side.index = candidates.BlockIndex(side.keys, windows)
+
+    # rows with equal identifiers are exact matches and skip the fuzzy search
+    key_pairs1, key_pairs2 = _match_exact_keys(df1, df2, _get_exact_keys(merge_config, columns))
+    key_matches = MatchResults(
+        side=np.full(len(key_pairs1), 2, dtype=np.int8),
+        df1_pos=key_pairs1,
+        df2_pos=key_pairs2,
+        score=np.full(len(key_pairs1), 100.0),
+        state=np.full(len(key_pairs1), MergeState.EXACT.value, dtype=np.int8),
+    )
+    side1.exclude(key_pairs1)
+    side2.exclude(key_pairs2)
+
+    one_to_one = merge_config.get("one_to_one", None)
+    if one_to_one is not None and one_to_one not in ONE_TO_ONE_STRATEGIES:
+        raise ValueError(
+            f"Unknown one_to_one strategy \"{one_to_one}\", expected one of {ONE_TO_ONE_STRATEGIES}."
+        )
+    cache = None
+    if config.content["join"]["similarity_config"]["merge"].get("cache"):
+        if one_to_one is not None:
+            logging.info("The match cache is not used with one_to_one merges.")
+        elif side1.ngram is not None or any(entry["window"] for entry in block_on):
+            # the shortlists and windows of new rows depend on every row, so searching only the
+            # new rows would not find the candidates of a full search
+            logging.info("The match cache is not used with ngram_index or block_on windows.")
+        else:
+            cache = MatchCache.for_config(
+                {
+                    "stage": stage,
+                    "columns": columns,
+                    "block_on": merge_config.get("block_on", None),
+                    "exact_keys": merge_config.get("exact_keys", None),
+                    "ngram_index": side1.ngram,
+                }
+            )
+            side1.hashes = row_hashes(
+                {column["into_"]: side1.normalized.get(column["into_"]) for column in columns}
+            )
+            side2.hashes = row_hashes(
+                {column["from_"]: side2.normalized.get(column["from_"]) for column in columns}
+            )
+
+    with tempfile.TemporaryDirectory(prefix="tesci-") as shared_dir:
+        if workers > 1:
+            if df1_index is not None:
+                # the indexed columns are memory-mapped by the workers in place
+                side1.shared = df1_index.columns_directory
+            else:
+                side1.share(Path(shared_dir) / "df1", [column["into_"] for column in columns])
+            side2.share(Path(shared_dir) / "df2", [column["from_"] for column in columns])
+        if one_to_one is not None:
+            matches = _match_one_to_one(
+                columns, side1, side2, key_matches, one_to_one, merge_config.get("top_k", 5), workers
+            )
+        else:
+            matches = _match_directional(columns, side1, side2, key_matches, workers, cache)
+    if cache is not None:
+        cache.save()
+
+    renames = {column["from_"]: column["into_"] for column in columns}
+    segments = {
+        name: _classified_segments(matches, state)
+        for name, state in (
+            ("exact", MergeState.EXACT),
+            ("suggested", MergeState.SUGGESTED),
+            ("potential", MergeState.POTENTIAL),
+            ("no", MergeState.NO_MATCH),
+        )
+    }
+    # potential matches are reported with the non-matches as well
+    segments["no"] = segments["no"] + segments["potential"]
+    final_segments = (
+        segments["exact"] + segments["suggested"] + segments["potential"] + segments["no"]
+    )
+    sides = {1: side1, 2: side2}
+    matches_dfs = {
+        name: _segment_rows(sides, name_segments, renames)
+        for name, name_segments in segments.items()
+    }
+    final_df = _segment_rows(sides, final_segments, renames).reset_index(drop=True)
+    final_normalized = _segment_normalized(sides, final_segments, renames, final_df)
+    merged_df = _merged_rows(df1, df2, matches)
+
+    counts = {state: int((matches.state == state.value).sum()) for state in MergeState}
     analytics = {
-        "exact_matches": len(exact_matches),
-        "suggested_matches": len(suggested_matches),
-        "potential_matches": len(potential_matches),
-        "no_matches": len(no_matches),
-        "sum of merged matches": len(exact_matches) + len(suggested_matches),
-        "sum of non-merged matches": len(potential_matches) + len(no_matches),
-        "total matches": len(exact_matches)
-        + len(suggested_matches)
-        + len(potential_matches)
-        + len(no_matches),
+        "exact_matches": counts[MergeState.EXACT],
+        "suggested_matches": counts[MergeState.SUGGESTED],
+        "potential_matches": counts[MergeState.POTENTIAL],
+        "no_matches": counts[MergeState.NO_MATCH],
+        "sum of merged matches": counts[MergeState.EXACT] + counts[MergeState.SUGGESTED],
+        "sum of non-merged matches": counts[MergeState.POTENTIAL] + counts[MergeState.NO_MATCH],
+        "total matches": len(matches.state),
         "df2 size": len(df2),
         "df1 size": len(df1),
         "merged_df size": len(merged_df),
@@ -395,26 +1164,202 @@ def _merge_two_sources(first_src: Path, second_src: Path, config: Config, stage:
 
     pp = pprint.PrettyPrinter(indent=4)
     pp.pprint(analytics)
-    df = merged_df
 
-    path_override = Path(dest) if dest is not None else None
-    for df, name in (
-        (exact_matches_df, "exact"),
-        (suggested_matches_df, "suggested"),
-        (potential_matches_df, "potential"),
-        (no_matches_df, "no"),
-    ):
-        DataSource.save_to_file(
-            df,
-            Config(),
-            name_override=f"config-{name}-matches.xls",
-            path_override=path_override,
+    return MergeOutput(matches=matches_dfs, final=final_df, normalized=final_normalized)
+
+
+@attrs.define
+class VerificationStep:
+    """Comparison of one merge column, see `VerificationPlan`."""
+
+    from_: str
+    into_: str
+    above: float
+    cutoff: float
+    comparator: comparators.Comparator | None = None
+
+    @property
+    def exact(self) -> bool:
+        """Only equal values can merge, a plain comparison decides EXACT before any scoring."""
+        return self.above >= 100
+
+    @property
+    def cost(self) -> int:
+        """Rank of the step in the plan: exact checks, then fuzzy columns."""
+        return 0 if self.exact else 1
+
+    def classify_scores(self, scores: np.ndarray) -> np.ndarray:
+        """MergeState values of the scores of a typed column, -1 where a value is missing."""
+        states = np.select(
+            [scores == 100, scores >= self.above, scores >= self.cutoff],
+            [MergeState.EXACT.value, MergeState.SUGGESTED.value, MergeState.POTENTIAL.value],
+            MergeState.NO_MATCH.value,
+        ).astype(np.int8)
+        states[np.isnan(scores)] = -1
+        return states
+
+    def classify(self, value2: str, value1: str) -> MergeState:
+        # QRatio is 100 for equal values only, but 0 for two empty values
+        if value2 == value1 and value2:
+            return MergeState.EXACT
+        # below score_cutoff QRatio returns 0 and stops early
+        ratio = fuzz.QRatio(value2, value1, processor=None, score_cutoff=self.cutoff)
+        if ratio == 100:
+            return MergeState.EXACT
+        if ratio >= self.above:
+            return MergeState.SUGGESTED
+        if ratio >= self.cutoff:
+            return MergeState.POTENTIAL
+        return MergeState.NO_MATCH
+
+    def explain(self) -> str:
+        if self.comparator is not None:
+            return (
+                f"{self.from_} -> {self.into_}: {self.comparator.describe()} (all pairs at once), "
+                f"100 exact, >= {self.above} suggested, >= {self.cutoff} potential"
+            )
+        if self.cutoff >= 100:
+            return f'{self.from_} -> {self.into_}: equal values, else no match'
+        if self.exact:
+            return (
+                f"{self.from_} -> {self.into_}: equal values, "
+                f"else QRatio >= {self.cutoff} potential"
+            )
+        return (
+            f"{self.from_} -> {self.into_}: QRatio (score_cutoff {self.cutoff}), "
+            f"100 exact, >= {self.above} suggested, >= {self.cutoff} potential"
         )
-    if save_to_disk_name_override is not None:
-        name_override = save_to_disk_name_override
-    else:
-        name_override = "config-final.xls"
-    DataSource.save_to_file(final_df, Config(), name_override=name_override)
+
+
+class VerificationPlan(object):
+    """
+    Compiled comparison of the merge columns of candidate pairs. The worst column state
+    decides the state of a pair, so the order of the columns does not change the result.
+    Typed columns (see `comparators`) are compared first, for all pairs at once, and only
+    the pairs they do not reject are compared on the text columns: cheap exact checks first,
+    then the fuzzy columns in config order. Columns with missing values are skipped. Text
+    evaluation stops at the first NO_MATCH, and at a POTENTIAL once none of the remaining
+    columns can reject the pair.
+    """
+
+    def __init__(self, columns: list[dict]) -> None:
+        steps = [
+            VerificationStep(
+                from_=column["from_"],
+                into_=column["into_"],
+                above=column["similarity"]["above"],
+                cutoff=column["similarity"]["cutoff"],
+                comparator=comparators.get_comparator(column["similarity"]),
+            )
+            for column in columns
+        ]
+        self.typed_steps = [step for step in steps if step.comparator is not None]
+        self.steps = sorted(
+            [step for step in steps if step.comparator is None], key=lambda step: step.cost
+        )
+        # whether any step from i on can still classify a pair as NO_MATCH
+        self._can_reject = [
+            any(step.cutoff > 0 for step in self.steps[i:]) for i in range(len(self.steps) + 1)
+        ]
+
+    def classify_typed(self, side1, side2, df1_pos, df2_pos) -> np.ndarray:
+        """MergeState values of pairs on the typed columns, EXACT when there are none."""
+        states = np.full(len(df1_pos), MergeState.EXACT.value, dtype=np.int8)
+        for step in self.typed_steps:
+            scores = step.comparator.scores(
+                side1.encode(step.into_, step.comparator),
+                df1_pos,
+                side2.encode(step.from_, step.comparator),
+                df2_pos,
+            )
+            np.maximum(states, step.classify_scores(scores), out=states)
+        return states
+
+    def classify(self, df2_normalized, pos2, df1_normalized, pos1) -> MergeState:
+        """Compares a row of df2 with a row of df1 on the text columns."""
+        state = MergeState.EXACT
+        for i, step in enumerate(self.steps):
+            value2 = df2_normalized.get(step.from_)[pos2]
+            value1 = df1_normalized.get(step.into_)[pos1]
+            if value2 is None or value1 is None:
+                continue
+            state = max(state, step.classify(value2, value1), key=lambda state: state.value)
+            if state == MergeState.NO_MATCH:
+                break
+            if state == MergeState.POTENTIAL and not self._can_reject[i + 1]:
+                break
+        return state
+
+    def explain(self) -> list[str]:
+        steps = self.typed_steps + self.steps
+        lines = [f"{i}. {step.explain()}" for i, step in enumerate(steps, start=1)]
+        lines.append("missing values are skipped, stops at the first no match")
+        return lines
+
+
+def _classified_segments(matches, state) -> list[tuple[int, np.ndarray]]:
+    """
+    Rows classified as state, in classification order, as (side, positions) segments: rows
+    of df2 first, then rows of df1. Empty segments are left out.
+    """
+    selected = matches.state == state.value
+    segments = [
+        (side, positions[selected & (matches.side == side)])
+        for side, positions in ((2, matches.df2_pos), (1, matches.df1_pos))
+    ]
+    return [(side, positions) for side, positions in segments if len(positions) > 0]
+
+
+def _segment_rows(sides, segments, renames) -> pd.DataFrame:
+    """Rows of segments with into_ column names."""
+    rows = [sides[side].df.iloc[positions].rename(columns=renames) for side, positions in segments]
+    return pd.concat(rows) if rows else pd.DataFrame()
+
+
+def _segment_normalized(sides, segments, renames, df) -> candidates.NormalizedColumns:
+    """
+    Normalized columns of the frame built by `_segment_rows`, gathered from the columns the
+    sides have already normalized. Only text columns are carried over, since concatenating
+    frames can change the dtype (and so the string form) of other columns.
+    """
+    columns = {}
+    for name in df.columns:
+        values = []
+        for side, positions in segments:
+            source_columns = {renames.get(col, col): col for col in sides[side].df.columns}
+            col = source_columns.get(name, None)
+            if col is None:
+                values.extend([None] * len(positions))
+                continue
+            if not _is_text(sides[side].df[col]) or col not in sides[side].normalized.cached():
+                break
+            cached = sides[side].normalized.cached()[col]
+            values.extend(cached[pos] for pos in positions)
+        else:
+            columns[name] = values
+    return candidates.NormalizedColumns(df, columns)
+
+
+def _is_text(series: pd.Series) -> bool:
+    return series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+
+
+def _merged_rows(df1, df2, matches) -> pd.DataFrame:
+    """Merged pairs (exact, then suggested), values of the matched candidate row take precedence."""
+    merged = []
+    for state in (MergeState.EXACT, MergeState.SUGGESTED):
+        selected = matches.state == state.value
+        for side, query_df, query_pos, candidate_df, candidate_pos in (
+            (2, df2, matches.df2_pos, df1, matches.df1_pos),
+            (1, df1, matches.df1_pos, df2, matches.df2_pos),
+        ):
+            pairs = selected & (matches.side == side)
+            if not pairs.any():
+                continue
+            query = query_df.iloc[query_pos[pairs]].reset_index(drop=True)
+            candidate = candidate_df.iloc[candidate_pos[pairs]].reset_index(drop=True)
+            merged.append(candidate.combine_first(query))
+    return pd.concat(merged, ignore_index=True) if merged else pd.DataFrame()
 
 
 def _get_multi_stage_nums(config) -> int:
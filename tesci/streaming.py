@@ -0,0 +1,205 @@
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tesci import candidates, similarity
+from tesci.scripts.context import CONFIG_HOME, ChunkReader, Config
+from tesci.similarity import MergeSide, MergeState
+
+# merge options that need all rows of the second source at once
+UNSUPPORTED_OPTIONS = ["block_on", "ngram_index", "one_to_one", "cache"]
+STATE_NAMES = {
+    MergeState.EXACT: "exact",
+    MergeState.SUGGESTED: "suggested",
+    MergeState.POTENTIAL: "potential",
+    MergeState.NO_MATCH: "no",
+}
+
+
+class _PartWriter(object):
+    """
+    CSV parts of the streamed outputs, one per state and side. Parts are written without a
+    header, in the column order of the outputs, so outputs are built by copying parts.
+    """
+
+    def __init__(self, directory: Path, header: list[str]) -> None:
+        self.directory = Path(directory)
+        self.header = header
+
+    def path(self, state: MergeState, side: int) -> Path:
+        return self.directory / f"{STATE_NAMES[state]}-{side}.csv"
+
+    def append(self, df: pd.DataFrame, state: MergeState, side: int) -> None:
+        df.reindex(columns=self.header).to_csv(
+            self.path(state, side), mode="a", header=False, index=False
+        )
+
+    def write(self, dest: Path, parts: list[tuple[MergeState, int]]) -> None:
+        with open(dest, "w", newline="") as dest_file:
+            pd.DataFrame(columns=self.header).to_csv(dest_file, index=False)
+            for state, side in parts:
+                if self.path(state, side).exists():
+                    with open(self.path(state, side), "r", newline="") as part_file:
+                        shutil.copyfileobj(part_file, dest_file)
+
+
+def merge(sources: list[Path], dest: Path | None, chunk_size: int, workers: int = 1) -> None:
+    """
+    Merges the second source into the first one, reading the second source in chunks of
+    chunk_size rows (CSV or Parquet). Only the first source, its normalized merge columns and
+    one chunk are kept in memory, and the outputs are written to CSV files as chunks are
+    matched. Results are the same as those of `similarity.merge`, except for the order of
+    the rows of the second source and `drop_duplicates`, which only applies within chunks.
+    """
+    config = Config()
+    if "similarity_config" not in config.content.get("join", {}).keys():
+        logging.info(
+            "No similarity_config to apply to the dataset. Are you using a config file that has similarity_config?"
+        )
+        return
+    if len(sources) != 2 or config.content["join"].get("multi_stage", False):
+        raise ValueError("Streaming merges support two sources without stages.")
+    merge_config = similarity._get_merge_config(config, None)
+    for option in UNSUPPORTED_OPTIONS:
+        if merge_config.get(option):
+            raise ValueError(f"The {option} merge option is not supported by streaming merges.")
+
+    columns = merge_config["columns"]
+    similarity.assert_no_duplicate_columns(
+        [col["from_"].lower() for col in columns], [col["into_"].lower() for col in columns]
+    )
+    for column in columns:
+        column["from_"] = column["from_"].lower()
+        column["into_"] = column["into_"].lower()
+    drop_duplicates = merge_config.get("drop_duplicates")
+
+    df1 = similarity._load_source(sources[0])
+    df1.rename(columns=str.lower, inplace=True)
+    if drop_duplicates:
+        df1.drop_duplicates(inplace=True)
+    df1.reset_index(drop=True, inplace=True)
+    similarity._preprocess_sources(columns, df1, None, workers)
+    reference_column = similarity._get_reference_column(columns)
+    side1 = MergeSide.create(df1, reference_column["into_"])
+    reader = ChunkReader(Path(sources[1]), chunk_size)
+
+    def prepared_chunks(chunk_columns=None):
+        """Preprocessed chunks, labelled by the row number of their rows in the source."""
+        offset = 0
+        for chunk in reader.chunks(chunk_columns):
+            chunk.rename(columns=str.lower, inplace=True)
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            if drop_duplicates and chunk_columns is None:
+                chunk.drop_duplicates(inplace=True)
+            similarity._preprocess_sources(columns, None, chunk, workers)
+            yield chunk
+
+    # first pass over the identifier columns only, so that rows matched by an exact key are
+    # never fuzzy candidates, whichever chunk their key is in. Duplicates are not dropped
+    # here, but exact keys only pair the first occurrence of a key, which is always kept.
+    exact_keys = similarity._get_exact_keys(merge_config, columns)
+    key_matched1 = np.zeros(len(df1), dtype=bool)
+    key_pairs2 = []
+    if exact_keys:
+        for chunk in prepared_chunks([column["from_"] for column in exact_keys]):
+            available1 = np.flatnonzero(~key_matched1)
+            pairs1, pairs2 = similarity._match_exact_keys(
+                df1.iloc[available1], chunk, exact_keys
+            )
+            key_matched1[available1[pairs1]] = True
+            key_pairs2.append(chunk.index.to_numpy()[pairs2])
+    key_pairs2 = np.concatenate(key_pairs2) if key_pairs2 else np.array([], dtype=np.int64)
+    side1.exclude(np.flatnonzero(key_matched1))
+
+    # best df2 candidate of every df1 row over the chunks seen so far, and its state
+    best2 = np.full(len(df1), -1, dtype=np.int64)
+    best2_score = np.full(len(df1), -1.0)
+    best2_state = np.full(len(df1), MergeState.NO_MATCH.value, dtype=np.int8)
+    merged1 = key_matched1.copy()
+    counts = {state: 0 for state in MergeState}
+    renames = {column["from_"]: column["into_"] for column in columns}
+
+    with tempfile.TemporaryDirectory(prefix="tesci-stream-") as parts_dir:
+        shared_dir = Path(parts_dir) / "shared"
+        if workers > 1:
+            # pool workers memory-map the normalized columns, df1 once and every chunk in turn
+            side1.share(shared_dir / "df1", [column["into_"] for column in columns])
+        writer = None
+        for chunk in prepared_chunks():
+            if len(chunk) == 0:
+                continue
+            if writer is None:
+                header = list(chunk.rename(columns=renames).columns)
+                header += [col for col in df1.columns if col not in header]
+                writer = _PartWriter(parts_dir, header)
+            side2 = MergeSide.create(chunk, reference_column["from_"])
+            key_rows = np.flatnonzero(np.isin(chunk.index.to_numpy(), key_pairs2))
+            side2.exclude(key_rows)
+            if workers > 1:
+                shutil.rmtree(shared_dir / "df2", ignore_errors=True)
+                side2.share(shared_dir / "df2", [column["from_"] for column in columns])
+            queries = np.setdiff1d(np.arange(len(chunk)), key_rows)
+
+            best_idx, _, best_query, best_query_score = candidates.best_candidates_both_ways(
+                side2.reference, side1.reference, workers=similarity._search_workers(workers)
+            )
+            best_idx = best_idx[queries]
+            states = similarity._classify_pairs(columns, side1, side2, best_idx, queries, workers)
+            merged = states <= MergeState.SUGGESTED.value
+            merged1[best_idx[merged]] = True
+
+            for state in MergeState:
+                rows = queries[states == state.value]
+                if state == MergeState.EXACT:
+                    rows = np.concatenate([key_rows, rows])
+                counts[state] += len(rows)
+                if len(rows) > 0:
+                    writer.append(chunk.iloc[rows].rename(columns=renames), state, 2)
+
+            # earlier chunks win ties, like the search over the whole source
+            improved = np.flatnonzero(best_query_score > best2_score)
+            best2[improved] = chunk.index.to_numpy()[best_query[improved]]
+            best2_score[improved] = best_query_score[improved]
+            best2_state[improved] = similarity._classify_pairs(
+                columns, side1, side2, improved, best_query[improved], workers
+            )
+            print(f"[df2] Matched rows {chunk.index[0]} to {chunk.index[-1]}")
+
+        if writer is None:
+            raise ValueError(f"Source {sources[1]} has no rows.")
+        # df1 rows left unmerged with their best df2 candidate
+        unmatched1 = np.flatnonzero(~merged1)
+        states1 = np.where(best2[unmatched1] >= 0, best2_state[unmatched1], MergeState.NO_MATCH.value)
+        for state in MergeState:
+            rows = unmatched1[states1 == state.value]
+            counts[state] += len(rows)
+            if len(rows) > 0:
+                writer.append(df1.iloc[rows], state, 1)
+
+        dest_path = Path(dest) if dest is not None else Path.cwd() / CONFIG_HOME
+
+        def both(state):
+            # rows of df2 first, then rows of df1, like the in-memory outputs
+            return [(state, 2), (state, 1)]
+
+        for state in (MergeState.EXACT, MergeState.SUGGESTED, MergeState.POTENTIAL):
+            writer.write(dest_path / f"config-{STATE_NAMES[state]}-matches.csv", both(state))
+        # potential matches are reported with the non-matches as well
+        writer.write(
+            dest_path / "config-no-matches.csv",
+            both(MergeState.NO_MATCH) + both(MergeState.POTENTIAL),
+        )
+        writer.write(
+            Path.cwd() / CONFIG_HOME / "config-final.csv",
+            both(MergeState.EXACT)
+            + both(MergeState.SUGGESTED)
+            + both(MergeState.POTENTIAL)
+            + both(MergeState.NO_MATCH)
+            + both(MergeState.POTENTIAL),
+        )
+    print({f"{STATE_NAMES[state]}_matches": count for state, count in counts.items()})
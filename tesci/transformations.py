@@ -5,9 +5,9 @@ import attrs
 from typing import Any
 from rapidfuzz import process, fuzz, utils
 from tesci.scripts.context import DataSource, Config
-from tesci.types import Aggregate, FuzzyColumnCandidates, MatchesPerColumn
+from tesci import column_profiles
+from tesci.types import Aggregate
 
-logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
 
 
@@ -65,8 +65,11 @@ def include(columns: list[str]) -> None:
 
 
 def validate_columns(data: DataSource, columns: list[str]) -> None:
-    """Validates that the columns exist in the dataset."""
-    df_columns = data.source.load().columns.tolist()
+    """Validates that the columns exist in the dataset, reading only the headers of the sources."""
+    if data.join_sources is not None:
+        df_columns = [column for source in data.join_sources.sources for column in source.schema()]
+    else:
+        df_columns = data.source.columns()
 
     for column in columns:
         if column not in df_columns:
@@ -88,7 +91,10 @@ def preview_dataset(data: DataSource, config: Config) -> None:
     aggregations = config.content.get("aggregate")
     sort = config.content.get("sort")
 
-    df = _apply_join(data) if data.join_sources is not None else data.source.load()
+    if data.join_sources is not None:
+        df = _apply_join(data)
+    else:
+        df = data.source.load(config.transformation_columns())
     df = _apply_include(df, columns)
     df = _apply_aggregations(df, aggregations, columns)
     df = _apply_sort(df, sort)
@@ -170,40 +176,18 @@ def _apply_join_fuzzy(data: DataSource) -> pd.DataFrame:
     if len(data.join_sources.sources) < 2:
         raise ValueError("Fuzzy join requires at least two sources.")
 
-    df1 = data.join_sources.sources[0].df
+    # the data source is shared within the process (see DataSource.get), df1 is modified
+    df1 = data.join_sources.sources[0].df.copy()
     df2 = data.join_sources.sources[1].df
 
-    matches = MatchesPerColumn()
-    # col1 = "Authors"
     # TODO: specify in config.yml which columns and with what score to merge data
-    for col1 in df1.columns:
-        print("[df1] Processing column: ", col1)
-        for data1 in df1[col1][1:20]:
-            for col2 in df2.columns:
-                try:
-                    score = process.extractOne(
-                        data1,
-                        df2[col2],
-                        scorer=fuzz.QRatio,
-                        processor=utils.default_process,
-                    )
-                    if score[1] < 80:
-                        continue
-
-                    matches.column_candidates.setdefault(col1, []).append(
-                        FuzzyColumnCandidates(
-                            column=col2, reference_data=data1, fuzzy_matches=score
-                        )
-                    )
-                except TypeError:
-                    pass
+    matches = column_profiles.match_columns(df1, df2, score_cutoff=80)
     matched_columns = []
-    for col1, candidates in matches.column_candidates.items():
-        if len(candidates) == 0:
+    for col1, column_candidates in matches.column_candidates.items():
+        if len(column_candidates) == 0:
             continue
-        matched_columns.append((col1, candidates[0].column))
+        matched_columns.append((col1, column_candidates[0].column))
 
-    breakpoint()
     # merge data from df2 with data from df1
     # however, only the data from df2 that has a fuzz qratio over 80 should get merged
     for col1, col2 in matched_columns:
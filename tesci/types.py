@@ -17,7 +17,7 @@ class FuzzyColumnCandidates:
 
 @attrs.define
 class MatchesPerColumn:
-    column_candidates: dict[str, FuzzyColumnCandidates] = attrs.field(default={})
+    column_candidates: dict[str, list[FuzzyColumnCandidates]] = attrs.field(factory=dict)
 
 
 # Author:
@@ -0,0 +1,57 @@
+import pandas as pd
+
+from tesci.scripts.context import FRAMES, JoinSource, Reader
+
+
+def test_full_and_projected_reads_stay_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "simple.csv"
+    path.write_text("Title,DOI\nA,10.1/a\nB,10.1/b\n")
+    FRAMES.clear()
+    parsed = []
+    parse = Reader._parse
+
+    def counting_parse(self, *args):
+        parsed.append(args)
+        return parse(self, *args)
+
+    monkeypatch.setattr(Reader, "_parse", counting_parse)
+
+    Reader(path).load()
+    Reader(path).load(["doi"])
+    Reader(path).load()
+    Reader(path).load(["doi"])
+
+    assert len(parsed) == 2
+    assert len(FRAMES._frames) == 2
+
+
+def test_row_count_does_not_load_the_source(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "simple.csv").write_text("Title,DOI\nA,10.1/a\nB,10.1/b\nC,\n")
+    pd.DataFrame({"Title": ["A", "B"]}).to_parquet(tmp_path / "simple.parquet")
+    FRAMES.clear()
+
+    def parse(self, *args):
+        raise AssertionError(f"{self.path.name} was parsed")
+
+    monkeypatch.setattr(Reader, "_parse", parse)
+
+    assert JoinSource(Reader(tmp_path / "simple.csv"), None).row_count() == 3
+    assert JoinSource(Reader(tmp_path / "simple.parquet"), None).row_count() == 2
+
+
+def test_row_count_reads_the_sidecar_metadata(tmp_path, monkeypatch):
+    (tmp_path / ".tesci").mkdir()
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "simple.csv"
+    path.write_text("Title,DOI\nA,10.1/a\nB,10.1/b\n")
+    Reader(path).load()
+    FRAMES.clear()
+
+    def read_file(self, *args):
+        raise AssertionError(f"{self.path.name} was read")
+
+    monkeypatch.setattr(Reader, "_read_file", read_file)
+
+    assert Reader(path).row_count() == 2
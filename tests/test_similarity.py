@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+from rapidfuzz import fuzz, process, utils
+
+from tesci import similarity
+from tesci.match_cache import MatchCache, row_hashes
+from tesci.scripts.context import DataSource
+from tesci.scripts.tesci import cli
+
+CONFIG = """
+join:
+  similarity: yes
+  similarity_config:
+    merge:
+      block_on:
+        - "Year"
+      exact_keys:
+        - "DOI"
+      columns:
+        - from_: "Title"
+          into_: "Article Title"
+          similarity:
+            above: 90
+            cutoff: 45
+          is_reference: yes
+        - from_: "Year"
+          into_: "Publication Year"
+          similarity:
+            above: 100
+            cutoff: 100
+        - from_: "DOI"
+          into_: "DOI"
+          similarity:
+            above: 100
+            cutoff: 100
+"""
+
+
+def test_explain_mixed_case_exact_keys_and_block_on(tmp_path, monkeypatch):
+    (tmp_path / ".tesci").mkdir()
+    (tmp_path / ".tesci" / "config.yml").write_text(CONFIG)
+    for name in ("wos.csv", "scopus.csv"):
+        (tmp_path / name).write_text("title\n")
+    monkeypatch.chdir(tmp_path)
+
+    result = CliRunner().invoke(
+        cli, ["similarity", "merge", "--explain", "-s", "wos.csv", "-s", "scopus.csv"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "exact keys: doi -> doi" in result.output
+    assert "block on: year -> publication year" in result.output
+
+
+def _side(titles):
+    side = similarity.MergeSide.create(pd.DataFrame({"title": titles}), "title")
+    side.hashes = row_hashes({"title": side.normalized.get("title")})
+    return side
+
+
+def test_cached_search_breaks_ties_like_a_full_search(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queries = _side(["abc"])
+    positions = np.arange(1)
+    cache = MatchCache("ties")
+    similarity._search_candidates_cached(cache, "df2", queries, positions, _side(["zzz", "abcd"]))
+    cache.save()
+
+    # "abce" is added before the cached candidate "abcd" and scores the same
+    choices = _side(["abce", "zzz", "abcd"])
+    cached_idx, cached_score = similarity._search_candidates_cached(
+        MatchCache("ties"), "df2", queries, positions, choices
+    )
+    idx, score = similarity._search_candidates(queries, positions, choices)
+
+    assert score[0] == cached_score[0]
+    assert cached_idx.tolist() == idx.tolist() == [0]
+
+
+def test_merge_rejects_options_that_do_not_work_together(tmp_path, monkeypatch):
+    for name in ("wos.csv", "scopus.csv"):
+        (tmp_path / name).write_text("title\n")
+    monkeypatch.chdir(tmp_path)
+    sources = ["-s", "wos.csv", "-s", "scopus.csv"]
+
+    for options in (
+        ["--cluster", "--chunk-size", "100"],
+        ["--explain", "--cluster"],
+        ["--explain", "--chunk-size", "100"],
+        ["--chunk-size", "100", "--keep-intermediates"],
+    ):
+        result = CliRunner().invoke(cli, ["similarity", "merge"] + sources + options)
+
+        assert result.exit_code == 2, result.output
+        assert "cannot be used together" in result.output
+
+
+def test_match_cache_is_not_used_with_ngram_index(tmp_path, monkeypatch):
+    (tmp_path / ".tesci").mkdir()
+    (tmp_path / ".tesci" / "config.yml").write_text(
+        CONFIG.replace(
+            "      block_on:",
+            "      cache: yes\n      ngram_index:\n        n: 3\n      block_on:",
+        )
+    )
+    (tmp_path / "wos.csv").write_text("Article Title,Publication Year,DOI\nFuzzy joins,2020,10.1/a\n")
+    (tmp_path / "scopus.csv").write_text("Title,Year,DOI\nFuzzy join,2020,10.1/b\n")
+    monkeypatch.chdir(tmp_path)
+
+    similarity.merge(["wos.csv", "scopus.csv"], None)
+
+    assert (tmp_path / ".tesci" / "config-final.xls").exists()
+    assert not (tmp_path / ".tesci" / "cache" / "matches").exists()
+
+
+MERGE_COLUMNS = [
+    {
+        "from_": "title",
+        "into_": "title",
+        "similarity": {"above": 90, "cutoff": 60, "preprocess": True},
+        "is_reference": True,
+    },
+    {"from_": "authors", "into_": "authors", "similarity": {"above": 80, "cutoff": 50, "preprocess": True}},
+    {"from_": "year", "into_": "year", "similarity": {"above": 100, "cutoff": 100, "preprocess": True}},
+]
+DF1 = pd.DataFrame(
+    {
+        "title": [
+            "Fuzzy joins of citation databases",
+            "Entity resolution at scale",
+            "A survey of record linkage",
+            "Deep learning for duplicate detection",
+            "Blocking methods for entity matching",
+            "Unrelated paper",
+        ],
+        "authors": ["Smith, J.", "Doe, A.", None, "Lee, K.", "Wang, X.", "Brown, P."],
+        "year": [2020, 2019, 2018, 2021, 2017, 2015],
+    }
+)
+DF2 = pd.DataFrame(
+    {
+        "title": [
+            "Fuzzy joins of citation databases",
+            "Entity resolution at scale.",
+            "A survey on record linkage",
+            "Deep learning for duplicates",
+            "Blocking methods for entity matching",
+            "Something else entirely",
+            "Entity resolution at scale",
+        ],
+        "authors": ["Smith, J.", "Doe, A", "Roe, B.", "Lee, K.", "Wang, Y.", "Green, T.", "Doe, A."],
+        "year": [2020, 2019, 2018, 2021, 2016, 2015, 2019],
+    }
+)
+
+
+def _loop_states(df1, df2, columns, pass_):
+    """Best candidate and state of every row, like the extractOne loop the engine replaced."""
+    reference = similarity._get_reference_column(columns)
+    query_df, choice_df = (df2, df1) if pass_ == 2 else (df1, df2)
+    query_col, choice_col = ("from_", "into_") if pass_ == 2 else ("into_", "from_")
+    results = []
+    for _, row in query_df.iterrows():
+        _, _, pos = process.extractOne(
+            row[reference[query_col]],
+            choice_df[reference[choice_col]],
+            scorer=fuzz.QRatio,
+            processor=utils.default_process,
+        )
+        states = []
+        for column in columns:
+            value, other = row[column[query_col]], choice_df.iloc[pos][column[choice_col]]
+            if pd.isna(value) or value == "nan" or pd.isna(other) or other == "nan":
+                continue
+            ratio = fuzz.QRatio(value, other, processor=utils.default_process)
+            if ratio == 100:
+                states.append(similarity.MergeState.EXACT)
+            elif ratio >= column["similarity"]["above"]:
+                states.append(similarity.MergeState.SUGGESTED)
+            elif ratio >= column["similarity"]["cutoff"]:
+                states.append(similarity.MergeState.POTENTIAL)
+            else:
+                states.append(similarity.MergeState.NO_MATCH)
+        results.append((pos, max((state.value for state in states), default=0)))
+    return results
+
+
+def test_batched_search_classifies_like_the_extract_one_loop():
+    df1, df2 = DF1.copy(), DF2.copy()
+    similarity._preprocess_sources(MERGE_COLUMNS, df1, df2)
+    side1 = similarity.MergeSide.create(df1, "title")
+    side2 = similarity.MergeSide.create(df2, "title")
+    empty = np.array([], dtype=np.int64)
+    key_matches = similarity.MatchResults(
+        side=empty.astype(np.int8),
+        df1_pos=empty,
+        df2_pos=empty,
+        score=empty.astype(float),
+        state=empty.astype(np.int8),
+    )
+
+    matches = similarity._match_directional(MERGE_COLUMNS, side1, side2, key_matches)
+
+    rows2 = matches.side == 2
+    assert list(zip(matches.df1_pos[rows2].tolist(), matches.state[rows2].tolist())) == _loop_states(
+        df1, df2, MERGE_COLUMNS, 2
+    )
+    # df1 rows merged by the first pass are not searched again
+    rows1 = matches.side == 1
+    expected = _loop_states(df1, df2, MERGE_COLUMNS, 1)
+    assert list(zip(matches.df2_pos[rows1].tolist(), matches.state[rows1].tolist())) == [
+        expected[pos] for pos in matches.df1_pos[rows1].tolist()
+    ]
+    assert len({state for _, state in expected}) > 2
+
+
+def test_merge_outputs_do_not_depend_on_the_number_of_workers(tmp_path, monkeypatch):
+    (tmp_path / ".tesci").mkdir()
+    (tmp_path / ".tesci" / "config.yml").write_text(CONFIG)
+    rows = 40
+    pd.DataFrame(
+        {
+            "Article Title": [f"Title {i} of a paper about topic {i % 7}" for i in range(rows)],
+            "Publication Year": [2000 + i % 5 for i in range(rows)],
+            "DOI": [f"10.1/{i}" if i % 3 else None for i in range(rows)],
+        }
+    ).to_csv(tmp_path / "wos.csv", index=False)
+    pd.DataFrame(
+        {
+            "Title": [f"Title {i} of paper about topic {i % 5}" for i in range(rows)],
+            "Year": [2000 + i % 4 for i in range(rows)],
+            "DOI": [f"10.1/{i}" if i % 4 == 0 else None for i in range(rows)],
+        }
+    ).to_csv(tmp_path / "scopus.csv", index=False)
+    monkeypatch.chdir(tmp_path)
+    # small merges are classified in-process, this one goes through the pool
+    monkeypatch.setattr(similarity, "MIN_PAIRS_PER_SHARD", 1)
+    outputs = {}
+
+    def save_to_file(df, config, name_override=None, path_override=None):
+        outputs[workers][name_override] = df.to_csv(index=False).encode("utf-8")
+
+    monkeypatch.setattr(DataSource, "save_to_file", save_to_file)
+
+    for workers in (1, 2):
+        outputs[workers] = {}
+        similarity.merge(["wos.csv", "scopus.csv"], None, workers)
+
+    assert outputs[1].keys() == outputs[2].keys() and len(outputs[1]) > 1
+    assert outputs[1] == outputs[2]
@@ -0,0 +1,35 @@
+import pytest
+
+import tesci.transformations as transformations
+from tesci.scripts.context import DataSource, Reader
+
+CONFIG = """
+join:
+  src:
+    - wos.csv
+    - scopus.csv
+  columns:
+    - DOI
+"""
+
+
+@pytest.fixture
+def join_config(tmp_path, monkeypatch):
+    (tmp_path / ".tesci").mkdir()
+    (tmp_path / ".tesci" / "config.yml").write_text(CONFIG)
+    (tmp_path / ".tesci" / "wos.csv").write_text("DOI,Article Title\n10.1/a,A\n")
+    (tmp_path / ".tesci" / "scopus.csv").write_text("DOI,Title\n10.1/a,A\n")
+    monkeypatch.chdir(tmp_path)
+
+    def parse(self, *args):
+        raise AssertionError(f"{self.path.name} was parsed")
+
+    monkeypatch.setattr(Reader, "_parse", parse)
+
+
+def test_validate_columns_of_join_sources_reads_headers_only(join_config):
+    data = DataSource.get()
+
+    transformations.validate_columns(data, ["Article Title", "Title"])
+    with pytest.raises(ValueError, match="Column 'Abstract' does not exist"):
+        transformations.validate_columns(data, ["Abstract"])